@@ -0,0 +1,102 @@
+"""Admission control for the storefront during a sale rush.
+
+Three independent layers, each cheap enough to run on every request:
+
+* :class:`RateLimiter` - a token bucket per client, so one visitor
+  hammering ``/add_to_cart`` can't crowd everyone else out.
+* :class:`ConcurrencyLimiter` - caps how many backend-heavy requests run at
+  once. Requests over the cap wait briefly for a slot and are then turned
+  away with a 503, instead of every request slowing down together.
+* :class:`WaitingRoom` - an optional virtual queue that hands each new
+  visitor an admission time, spaced so that visitors are let in in arrival
+  order at a fixed rate.
+
+Rate limits and the concurrency cap are kept per worker. The waiting room
+takes its slots from a ``claim_slot`` callable; ``main`` passes
+:meth:`shared_state.SharedState.claim_queue_slot` so every worker on the
+host draws from the same queue.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token buckets of ``burst`` tokens refilled at ``rate`` per second, one per client key."""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self._rate = rate
+        self._burst = burst
+        self._max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def allow(self, key):
+        """0 if ``key`` may go ahead, otherwise the seconds until it may retry."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self._burst, now))
+            tokens = min(self._burst, tokens + (now - updated_at) * self._rate)
+            if tokens >= 1:
+                wait = 0
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self._rate
+            self._buckets[key] = (tokens, now)
+            # Least recently seen clients go first; they'd be back to a full bucket anyway
+            while len(self._buckets) > self._max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class ConcurrencyLimiter:
+    """At most ``limit`` requests in flight; the rest wait up to ``timeout`` seconds."""
+
+    def __init__(self, limit, timeout=2):
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self.limit = limit
+        self.in_flight = 0
+
+    def acquire(self):
+        if not self._semaphore.acquire(timeout=self._timeout):
+            return False
+        with self._lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+
+class WaitingRoom:
+    """Admit visitors in arrival order, ``rate`` per second after an initial ``burst``.
+
+    :meth:`claim` returns the wall-clock time a new visitor may enter. Slots
+    follow the generic cell rate algorithm: each one is ``1 / rate`` seconds
+    after the previous, and while the room is quiet the first ``burst``
+    visitors get a slot in the past, i.e. walk straight in.
+    """
+
+    def __init__(self, rate, burst=0, claim_slot=None):
+        self.rate = rate
+        self._interval = 1 / rate
+        self._burst = burst
+        self._claim_slot = claim_slot or self._claim_local_slot
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def claim(self):
+        return self._claim_slot(self._interval, self._burst)
+
+    def ahead_of(self, admit_at):
+        """Roughly how many visitors will be let in before one admitted at ``admit_at``."""
+        return max(0, int((admit_at - time.time()) * self.rate))
+
+    def _claim_local_slot(self, interval, burst):
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.time() - burst * interval) + interval
+            return self._next_slot
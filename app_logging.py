@@ -0,0 +1,157 @@
+"""Structured logging that stays off the request thread.
+
+:func:`configure_logging` routes every logger through a bounded queue. A
+listener thread formats the records as one JSON object per line and writes
+them to stdout, so a request only pays for building the record. If the queue
+ever fills up (stdout blocked, say), records are dropped and counted rather
+than stalling requests.
+
+Code logs short snake_case event names with details passed as ``extra``::
+
+    log.info('order_placed', extra={'order_id': order_id, 'items': 3})
+
+Every record carries the id of the request it was logged from (taken from
+an incoming ``X-Request-ID`` header or generated), and chatty events can be
+sampled by name, e.g. ``LOG_SAMPLE_RATES="cart_item_added=0.05"``. Warnings
+and errors are never sampled out.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id', 'sample_rate'}
+
+_listener = None
+_handler = None
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request id."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the events named in ``rates`` (below WARNING)."""
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+
+    def filter(self, record):
+        rate = self.rates.get(record.msg)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'sample_rate', None) is not None:
+            entry['sample_rate'] = record.sample_rate
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue records unformatted; drop them instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread. Tracebacks are rendered
+        # here while the frames they point at still exist.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=None, sample_rates=None, stream=None, max_queue=10000):
+    """Send all logging through the JSON queue pipeline; safe to call more than once."""
+    global _listener, _handler
+
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    rates = dict(sample_rates or {})
+    for pair in filter(None, os.environ.get('LOG_SAMPLE_RATES', '').split(',')):
+        event, _, rate = pair.partition('=')
+        rates[event.strip()] = float(rate)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    if _listener is not None:
+        _listener.stop()
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=max_queue))
+    _handler.addFilter(RequestContextFilter())
+    _handler.addFilter(SamplingFilter(rates))
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level)
+    return _handler
+
+
+def dropped_records():
+    return _handler.dropped if _handler is not None else 0
+
+
+def _restart_listener():
+    # The listener thread doesn't survive a fork (gunicorn --preload)
+    # and the queue's lock may have been held by it when we forked
+    if _listener is not None:
+        _handler.queue = _listener.queue = queue.Queue(maxsize=_handler.queue.maxsize)
+        _listener._thread = None
+        _listener.start()
+
+
+def _stop_listener():
+    # Flush whatever is still queued on the way out
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+os.register_at_fork(after_in_child=_restart_listener)
+atexit.register(_stop_listener)
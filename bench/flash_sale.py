@@ -0,0 +1,318 @@
+"""Flash-sale load test for the storefront and admin routes.
+
+Seeds a local SQLite backend with N menu items and M historical orders, then
+replays sale-opening traffic from concurrent simulated customers against the
+app and reports throughput, latency percentiles and backend calls per
+request for every route::
+
+    python bench/flash_sale.py --items 40 --orders 20000 --clients 32 --requests 4000
+
+Results are written as JSON (``bench/results/`` by default) together with the
+git revision, so runs can be compared with ``--baseline old.json``.
+"""
+import argparse
+import contextvars
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Share of sessions that are an admin loading the dashboard
+ADMIN_SHARE = 0.02
+# Share of customers who reach checkout but never place the order
+ABANDON_RATE = 0.3
+
+
+class BackendCallCounter:
+    """Counts repository calls made for the current request.
+
+    The count lives in a context variable, so calls the app runs on its
+    query pool (which copies the caller's context) are counted as well.
+    """
+
+    def __init__(self):
+        self._calls = contextvars.ContextVar('backend_calls', default=None)
+
+    def wrap(self, cls):
+        for name in dir(cls):
+            if name.startswith('_') or not callable(getattr(cls, name)):
+                continue
+            setattr(cls, name, self._counted(getattr(cls, name)))
+
+    def reset(self):
+        self._calls.set([0])
+
+    def take(self):
+        calls = self._calls.get()
+        self._calls.set([0])
+        return calls[0] if calls else 0
+
+    def _counted(self, method):
+        counter = self
+
+        def wrapper(*args, **kwargs):
+            calls = counter._calls.get()
+            if calls is not None:
+                calls[0] += 1
+            return method(*args, **kwargs)
+
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def seed(repository, items, orders, stock, rng):
+    menu = [
+        {'id': item_id, 'name': f'Item {item_id}', 'price': round(rng.uniform(0.25, 3), 3),
+         'quantity': stock, 'image': f'https://example.invalid/{item_id}.jpg'}
+        for item_id in range(1, items + 1)
+    ]
+    repository.insert_food_items(menu)
+    sale = repository.create_sale({'name': 'Benchmark Sale', 'sale_date': '2025-05-31'},
+                                  {item['id']: stock for item in menu})
+
+    from order_items import format_items_text
+
+    batch = []
+    for order_id in range(1, orders + 1):
+        line_items = [
+            {'item_id': item['id'], 'name': item['name'], 'quantity': rng.randint(1, 3), 'unit_price': item['price']}
+            for item in rng.sample(menu, rng.randint(1, min(4, items)))
+        ]
+        batch.append({
+            'order_id': order_id,
+            'customer_name': f'Customer {order_id}',
+            'phone': 50000000 + order_id,
+            'membership': 0,
+            'item': format_items_text(line_items),
+            'line_items': line_items,
+            'quantity': sum(line['quantity'] for line in line_items),
+            'sale_id': sale['id'],
+        })
+        if len(batch) == 1000:
+            repository.insert_orders(batch)
+            batch = []
+    repository.insert_orders(batch)
+    repository.recount()
+    return menu
+
+
+class InProcessClient:
+    """Drives the Flask app through its test client, counting backend calls."""
+
+    def __init__(self, app, counter):
+        self._client = app.test_client()
+        self._counter = counter
+
+    def request(self, method, path, **kwargs):
+        self._counter.reset()
+        started = time.perf_counter()
+        response = self._client.open(path, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, self._counter.take()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Report 302s as they are instead of following them
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Drives a running server (e.g. gunicorn) over HTTP with its own cookie jar."""
+
+    def __init__(self, base_url):
+        self._base_url = base_url.rstrip('/')
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect(),
+        )
+
+    def request(self, method, path, **kwargs):
+        headers = {}
+        body = None
+        if kwargs.get('json') is not None:
+            body = json.dumps(kwargs['json']).encode()
+            headers['Content-Type'] = 'application/json'
+        elif kwargs.get('data') is not None:
+            body = urllib.parse.urlencode(kwargs['data']).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        req = urllib.request.Request(self._base_url + path, data=body, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with self._opener.open(req, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        return status, time.perf_counter() - started, None
+
+
+def run_customer(client, menu, rng, record):
+    """One customer session: browse, add to cart, check out, maybe order."""
+    if rng.random() < ADMIN_SHARE:
+        return record('/admin', *client.request('GET', '/admin'))
+
+    if not record('/', *client.request('GET', '/')):
+        return
+    # The storefront sends a burst of add clicks as one batch
+    operations = [{'op': 'add', 'item_id': str(item['id']), 'quantity': rng.randint(1, 2)}
+                  for item in rng.sample(menu, rng.randint(1, min(3, len(menu))))]
+    if not record('/cart/batch', *client.request('POST', '/cart/batch', json={'operations': operations})):
+        return
+    if not record('/checkout', *client.request('GET', '/checkout')):
+        return
+    if rng.random() < ABANDON_RATE:
+        return
+    record('/place_order', *client.request(
+        'POST', '/place_order', data={'name': 'Load Test', 'phone': str(rng.randint(50000000, 99999999))}))
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    counter = BackendCallCounter()
+    app = None
+    menu = None
+
+    if args.url:
+        menu = [{'id': item_id} for item_id in range(1, args.items + 1)]
+    else:
+        tmp = tempfile.mkdtemp(prefix='flash_sale_')
+        os.environ['STORAGE_BACKEND'] = 'sqlite'
+        os.environ['SQLITE_PATH'] = os.path.join(tmp, 'bench.db')
+        os.environ['SHARED_STATE_PATH'] = os.path.join(tmp, 'shared_state.bin')
+        os.environ['CART_STORE_PATH'] = os.path.join(tmp, 'carts.db')
+        os.environ.setdefault('DELETE_PASS', 'bench')
+
+        from storage import SQLiteRepository
+        counter.wrap(SQLiteRepository)
+
+        import main
+        app = main.app
+        menu = seed(main.repository, args.items, args.orders, args.stock, rng)
+
+    samples = {}
+    samples_lock = threading.Lock()
+    issued = [0]
+
+    def record(route, status, elapsed, backend_calls):
+        with samples_lock:
+            stats = samples.setdefault(route, {'latencies': [], 'errors': 0, 'backend_calls': 0})
+            stats['latencies'].append(elapsed)
+            # Rate limiting and admission rejections (429, 403) count as errors too
+            if status >= 400:
+                stats['errors'] += 1
+            if backend_calls is not None:
+                stats['backend_calls'] += backend_calls
+            issued[0] += 1
+            return issued[0] < args.requests
+
+    def customer_loop(seed_value):
+        local_rng = random.Random(seed_value)
+        while True:
+            with samples_lock:
+                if issued[0] >= args.requests:
+                    return
+            client = HttpClient(args.url) if args.url else InProcessClient(app, counter)
+            run_customer(client, menu, local_rng, record)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=customer_loop, args=(rng.random(),)) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    for route, stats in sorted(samples.items()):
+        latencies = sorted(stats['latencies'])
+        count = len(latencies)
+        routes[route] = {
+            'requests': count,
+            'errors': stats['errors'],
+            'throughput_rps': round(count / elapsed, 1),
+            'mean_ms': round(sum(latencies) / count * 1000, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'backend_calls_per_request': None if args.url else round(stats['backend_calls'] / count, 2),
+        }
+
+    total = sum(route['requests'] for route in routes.values())
+    return {
+        'revision': _git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1),
+        'routes': routes,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    print(f"{result['throughput_rps']} req/s over {result['duration_s']}s (revision {result['revision']})")
+    print(f"{'route':<14}{'reqs':>7}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'calls':>7}")
+    for route, stats in result['routes'].items():
+        line = (f"{route:<14}{stats['requests']:>7}{stats['errors']:>5}{stats['throughput_rps']:>9}"
+                f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+                f"{stats['backend_calls_per_request'] if stats['backend_calls_per_request'] is not None else '-':>7}")
+        before = (baseline or {}).get('routes', {}).get(route)
+        if before and before['p95_ms']:
+            line += f"  p95 {((stats['p95_ms'] - before['p95_ms']) / before['p95_ms']) * 100:+.1f}%"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=40, help="menu items to seed")
+    parser.add_argument('--orders', type=int, default=10000, help="historical orders to seed")
+    parser.add_argument('--stock', type=int, default=1000000, help="starting stock per item")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent simulated customers")
+    parser.add_argument('--requests', type=int, default=2000, help="total requests to issue")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--url', help="benchmark a running server instead of the app in-process")
+    parser.add_argument('--output', help="where to write the JSON results")
+    parser.add_argument('--baseline', help="earlier results JSON to compare p95 latencies against")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output or os.path.join(
+        ROOT, 'bench', 'results', f"flash_sale_{result['revision'] or 'local'}_{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
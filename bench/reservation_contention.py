@@ -0,0 +1,108 @@
+"""Hammer SQLiteReserver from many threads and check nothing is oversold.
+
+    python bench/reservation_contention.py --threads 32 --stock 500
+
+Every thread keeps placing small orders for the same few items of one sale
+until they are sold out. At the end the units reserved in ``sale-items``
+must equal the units in accepted orders and never exceed the stock. A run
+in which no order got through fails too, since it checked nothing, and so
+does one in which an order with a negative line item is accepted.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reservation import InsufficientStock
+from storage import SQLiteRepository
+
+
+def run(threads, stock, items, max_quantity, path):
+    reserver = SQLiteRepository(path)
+    reserver.seed_items([{'id': i, 'name': f'Item {i}', 'price': 1} for i in range(1, items + 1)])
+    sale_id = reserver.create_sale({'name': 'Contention Sale'}, {i: stock for i in range(1, items + 1)})['id']
+
+    order_ids = iter(range(1, 10 ** 9))
+    id_lock = threading.Lock()
+    accepted = []
+    rejected = [0]
+    results_lock = threading.Lock()
+
+    # A negative line would hand units back to reserved for others to sell
+    try:
+        reserver.place_order({'order_id': next(order_ids), 'sale_id': sale_id, 'line_items': [
+            {'item_id': 1, 'name': 'Item 1', 'quantity': -max_quantity, 'unit_price': 1}]})
+        negative_refused = False
+    except ValueError:
+        negative_refused = True
+
+    def buyer(seed):
+        rng = random.Random(seed)
+        misses = 0
+        # Stop once a buyer has been turned away a few times in a row
+        while misses < 5:
+            with id_lock:
+                order_id = next(order_ids)
+            line_items = [
+                {'item_id': item_id, 'name': f'Item {item_id}', 'quantity': rng.randint(1, max_quantity), 'unit_price': 1}
+                for item_id in rng.sample(range(1, items + 1), rng.randint(1, items))
+            ]
+            try:
+                reserver.place_order({'order_id': order_id, 'line_items': line_items, 'sale_id': sale_id})
+            except InsufficientStock:
+                misses += 1
+                with results_lock:
+                    rejected[0] += 1
+                continue
+            misses = 0
+            with results_lock:
+                accepted.append(line_items)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=buyer, args=(seed,)) for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    sold = {}
+    for line_items in accepted:
+        for line in line_items:
+            sold[line['item_id']] = sold.get(line['item_id'], 0) + line['quantity']
+    reserved = {row['item_id']: row['reserved'] for row in reserver._connection().execute(
+        'select item_id, reserved from "sale-items" where sale_id = ?', (sale_id,))}
+
+    return {
+        'threads': threads,
+        'stock_per_item': stock,
+        'accepted_orders': len(accepted),
+        'rejected_orders': rejected[0],
+        'orders_per_second': round((len(accepted) + rejected[0]) / elapsed, 1),
+        'oversold': any(quantity > stock for quantity in list(sold.values()) + list(reserved.values())),
+        'negative_quantity_refused': negative_refused,
+        'ledger_matches': sold == {item_id: quantity for item_id, quantity in reserved.items() if quantity},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--stock', type=int, default=200)
+    parser.add_argument('--items', type=int, default=3)
+    parser.add_argument('--max-quantity', type=int, default=3)
+    parser.add_argument('--db', help="SQLite file to use (default: a temporary file)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'reservation.db')
+        result = run(args.threads, args.stock, args.items, args.max_quantity, path)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if (result['oversold'] or not result['ledger_matches'] or not result['accepted_orders']
+                   or not result['negative_quantity_refused']) else 0)
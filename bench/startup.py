@@ -0,0 +1,201 @@
+"""Worker start-up time and memory benchmark.
+
+Measures two things against a local SQLite backend:
+
+* ``import``: how long a fresh interpreter takes to import ``main`` (which
+  builds the app) and its resident memory afterwards, over several runs.
+* ``gunicorn``: starts gunicorn with N workers, with and without
+  ``--preload``, and reports the time until the first request is served and
+  the total proportional set size (PSS) of the master and its workers.
+
+::
+
+    python bench/startup.py --workers 4
+    python bench/startup.py --tree /tmp/old-checkout --output old.json
+
+``--tree`` points at another checkout (e.g. ``git worktree add /tmp/old
+HEAD~1``) so two revisions can be compared with ``--baseline``.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import os, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+with open('/proc/self/status') as f:
+    rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+print(elapsed, rss_kb)
+"""
+
+
+def bench_env(tmp):
+    env = dict(os.environ)
+    env.update({
+        'STORAGE_BACKEND': 'sqlite',
+        'SQLITE_PATH': os.path.join(tmp, 'startup.db'),
+        'SHARED_STATE_PATH': os.path.join(tmp, 'shared_state.bin'),
+        'CART_STORE_PATH': os.path.join(tmp, 'carts.db'),
+        'LOG_LEVEL': 'WARNING',
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    return env
+
+
+def measure_import(tree, env, runs):
+    timings, rss = [], []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE], cwd=tree, env=env, text=True)
+        elapsed, rss_kb = output.split()[-2:]
+        timings.append(float(elapsed))
+        rss.append(int(rss_kb))
+    return {
+        'import_ms': round(statistics.median(timings) * 1000, 1),
+        'rss_mb': round(statistics.median(rss) / 1024, 1),
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _pss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+    except (OSError, StopIteration):
+        return 0
+
+
+def measure_gunicorn(tree, env, workers, preload, timeout=60):
+    port = _free_port()
+    command = [shutil.which('gunicorn') or 'gunicorn', 'main:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--config', '/dev/null']
+    if preload:
+        command.append('--preload')
+
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = None
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/bookings_closed', timeout=1):
+                    ready = time.perf_counter() - started
+                    break
+            except OSError:
+                time.sleep(0.02)
+        if ready is None:
+            raise RuntimeError("gunicorn did not come up")
+
+        # Let every worker finish booting before sampling memory
+        deadline = time.perf_counter() + timeout
+        while len(_children(process.pid)) < workers and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        time.sleep(1)
+
+        pids = [process.pid] + _children(process.pid)
+        return {
+            'first_response_ms': round(ready * 1000, 1),
+            'processes': len(pids),
+            'total_pss_mb': round(sum(_pss_kb(pid) for pid in pids) / 1024, 1),
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def run(args):
+    tree = os.path.abspath(args.tree or ROOT)
+    tmp = tempfile.mkdtemp(prefix='startup_')
+    env = bench_env(tmp)
+    try:
+        result = {
+            'revision': _git_revision(tree),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': {'workers': args.workers, 'runs': args.runs},
+            'import': measure_import(tree, env, args.runs),
+        }
+        if not args.skip_gunicorn:
+            result['gunicorn'] = {
+                'no_preload': measure_gunicorn(tree, env, args.workers, preload=False),
+                'preload': measure_gunicorn(tree, env, args.workers, preload=True),
+            }
+        return result
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _git_revision(tree):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=tree, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _change(now, before):
+    if not before:
+        return ''
+    return f"  ({(now - before) / before * 100:+.1f}%)"
+
+
+def print_report(result, baseline=None):
+    baseline = baseline or {}
+    before = baseline.get('import', {})
+    print(f"revision {result['revision']}")
+    print(f"import main: {result['import']['import_ms']} ms{_change(result['import']['import_ms'], before.get('import_ms'))}, "
+          f"RSS {result['import']['rss_mb']} MB{_change(result['import']['rss_mb'], before.get('rss_mb'))}")
+    for mode, stats in result.get('gunicorn', {}).items():
+        before = baseline.get('gunicorn', {}).get(mode, {})
+        print(f"gunicorn {mode:<10} {stats['processes']} processes, first response {stats['first_response_ms']} ms"
+              f"{_change(stats['first_response_ms'], before.get('first_response_ms'))}, total PSS "
+              f"{stats['total_pss_mb']} MB{_change(stats['total_pss_mb'], before.get('total_pss_mb'))}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers to start")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters to time the import in")
+    parser.add_argument('--tree', help="checkout to benchmark instead of this one")
+    parser.add_argument('--skip-gunicorn', action='store_true', help="only time the import")
+    parser.add_argument('--output', help="where to write the JSON results")
+    parser.add_argument('--baseline', help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output or os.path.join(
+        ROOT, 'bench', 'results', f"startup_{result['revision'] or 'local'}_{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
@@ -0,0 +1,97 @@
+"""Cart edits checked against one stock snapshot.
+
+The storefront queues clicks and sends them to ``/cart/batch`` as a list of
+operations::
+
+    {"operations": [{"op": "add", "item_id": "3", "quantity": 2},
+                    {"op": "update", "item_id": "5", "quantity": 1},
+                    {"op": "remove", "item_id": "7"}]}
+
+:func:`apply_cart_operations` applies them in order to a ``{item_id:
+quantity}`` cart using menu items and ordered totals looked up once for the
+whole batch, and reports every operation it could not apply in full.
+"""
+
+OPERATIONS = ('add', 'update', 'remove')
+
+# More than a customer can click between two flushes
+MAX_OPERATIONS = 50
+
+
+def parse_operations(payload):
+    """``[(op, item_id, quantity)]`` from a ``/cart/batch`` body; raises ValueError if malformed."""
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("Expected a non-empty list of operations")
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError(f"At most {MAX_OPERATIONS} operations per batch")
+
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {operation!r}")
+        if operation.get('item_id') is None:
+            raise ValueError(f"Operation without an item_id: {operation!r}")
+        op = operation['op']
+        try:
+            quantity = int(operation.get('quantity', 1 if op == 'add' else 0))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid quantity: {operation!r}")
+        if op == 'add' and quantity < 1:
+            raise ValueError(f"Invalid quantity: {operation!r}")
+        parsed.append((op, str(operation['item_id']), quantity))
+    return parsed
+
+
+def apply_cart_operations(cart, operations, menu_items, ordered):
+    """Apply ``operations`` to ``cart`` in place; returns the adjustments made.
+
+    ``menu_items`` maps item ids to ``food-items`` rows and ``ordered`` item
+    names to units already ordered. Adds and updates are capped at the stock
+    left. Each adjustment is ``{item_id, op, requested, quantity, reason,
+    message}``, ``quantity`` being what the cart now holds and ``reason`` one
+    of ``not_found``, ``out_of_stock`` or ``limited``.
+    """
+    adjustments = []
+
+    def adjust(op, item_id, requested, reason, message):
+        adjustments.append({'item_id': item_id, 'op': op, 'requested': requested,
+                            'quantity': cart.get(item_id, 0), 'reason': reason, 'message': message})
+
+    for op, item_id, quantity in operations:
+        if op == 'remove' or (op == 'update' and quantity <= 0):
+            cart.pop(item_id, None)
+            continue
+
+        item = menu_items.get(item_id)
+        if item is None:
+            adjust(op, item_id, quantity, 'not_found', 'Item not found')
+            continue
+
+        available = item.get('quantity', 0) - ordered.get(item['name'], 0)
+        current = cart.get(item_id, 0)
+
+        if op == 'add':
+            can_add = available - current
+            if can_add <= 0:
+                adjust(op, item_id, quantity, 'out_of_stock', f"{item['name']} is out of stock.")
+                continue
+            added = min(quantity, can_add)
+            cart[item_id] = current + added
+            if added < quantity:
+                adjust(op, item_id, quantity, 'limited',
+                       f"Only {added} of {item['name']} could be added due to stock limitations.")
+            continue
+
+        # update: set the quantity outright, as far as the stock goes
+        if available <= 0:
+            cart.pop(item_id, None)
+            adjust(op, item_id, quantity, 'out_of_stock', f"{item['name']} is out of stock.")
+        elif quantity > available:
+            cart[item_id] = available
+            adjust(op, item_id, quantity, 'limited',
+                   f"Only {available} of {item['name']} are left; your cart has been updated.")
+        else:
+            cart[item_id] = quantity
+
+    return adjustments
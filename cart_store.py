@@ -0,0 +1,188 @@
+"""Server-side storage for shopping carts.
+
+The session cookie only carries a random ``cart_id``; the cart itself lives
+here as a compact ``{item_id: quantity}`` dict; names, prices and images
+are looked up in the menu catalog when the cart is displayed or ordered.
+
+``CART_STORE`` picks the backend:
+
+* ``sqlite`` (default) - a SQLite file at ``CART_STORE_PATH``, shared by
+  every worker on the host, so a cart is there whichever worker serves the
+  next request.
+* ``redis`` - any Redis-protocol server at ``REDIS_URL``, shared by every
+  worker. Without ``REDIS_URL`` it runs against :class:`LocalRedis`, an
+  in-process stand-in, so the code path can be exercised without a server.
+* ``memory`` - an LRU in each worker with idle expiry. Carts are lost on
+  restart and only work with a single worker; ``gunicorn.conf.py`` refuses
+  to start it (or ``LocalRedis``) with more than one.
+"""
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_connections import ThreadLocalConnections
+
+log = logging.getLogger(__name__)
+
+
+def new_cart_id():
+    return secrets.token_urlsafe(16)
+
+
+class MemoryCartStore:
+    """Carts kept in this process, least recently used evicted first."""
+
+    def __init__(self, ttl=86400, max_carts=10000):
+        self._ttl = ttl
+        self._max_carts = max_carts
+        self._lock = threading.Lock()
+        self._carts = OrderedDict()  # cart_id -> (cart, expires_at)
+
+    def get(self, cart_id):
+        with self._lock:
+            entry = self._carts.get(cart_id)
+            if entry is None:
+                return {}
+            if entry[1] <= time.monotonic():
+                del self._carts[cart_id]
+                return {}
+            self._carts.move_to_end(cart_id)
+            return dict(entry[0])
+
+    def save(self, cart_id, cart):
+        if not cart:
+            return self.delete(cart_id)
+        with self._lock:
+            self._carts[cart_id] = (dict(cart), time.monotonic() + self._ttl)
+            self._carts.move_to_end(cart_id)
+            while len(self._carts) > self._max_carts:
+                self._carts.popitem(last=False)
+
+    def delete(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+    def __len__(self):
+        return len(self._carts)
+
+
+class SQLiteCartStore:
+    """Carts in a SQLite file, readable by every worker process on the host."""
+
+    # Expired carts are deleted every this many saves
+    PURGE_EVERY = 1000
+
+    def __init__(self, path='carts.db', ttl=86400, timeout=5):
+        self._ttl = ttl
+        # Losing the last cart edit in a power cut is fine; an fsync per click isn't
+        self._connections = ThreadLocalConnections(path, timeout=timeout, synchronous='normal')
+        self._saves = 0
+        self._connection().execute(
+            'create table if not exists carts (cart_id text primary key, cart text not null, expires_at real not null)')
+
+    def get(self, cart_id):
+        row = self._connection().execute(
+            'select cart from carts where cart_id = ? and expires_at > ?', (cart_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save(self, cart_id, cart):
+        if not cart:
+            return self.delete(cart_id)
+        conn = self._connection()
+        conn.execute('insert or replace into carts (cart_id, cart, expires_at) values (?, ?, ?)',
+                     (cart_id, json.dumps(cart, separators=(',', ':')), time.time() + self._ttl))
+        self._saves += 1
+        if self._saves % self.PURGE_EVERY == 0:
+            conn.execute('delete from carts where expires_at <= ?', (time.time(),))
+
+    def delete(self, cart_id):
+        self._connection().execute('delete from carts where cart_id = ?', (cart_id,))
+
+    def _connection(self):
+        return self._connections.get()
+
+
+class RedisCartStore:
+    """Carts stored as JSON strings under ``cart:<id>`` with a sliding expiry."""
+
+    def __init__(self, client, ttl=86400, prefix='cart:'):
+        self._client = client
+        self._ttl = ttl
+        self._prefix = prefix
+
+    def get(self, cart_id):
+        value = self._client.get(self._prefix + cart_id)
+        if not value:
+            return {}
+        return json.loads(value)
+
+    def save(self, cart_id, cart):
+        if not cart:
+            return self.delete(cart_id)
+        self._client.setex(self._prefix + cart_id, self._ttl, json.dumps(cart, separators=(',', ':')))
+
+    def delete(self, cart_id):
+        self._client.delete(self._prefix + cart_id)
+
+
+class LocalRedis:
+    """The handful of Redis commands the cart store uses, held in memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # key -> (value, expires_at)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._values[key]
+                return None
+            return entry[0]
+
+    def setex(self, key, seconds, value):
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + seconds)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._values.pop(key, None) is not None)
+
+
+def is_per_process(backend=None):
+    """Whether the configured store keeps carts inside each worker process."""
+    backend = (backend or os.environ.get('CART_STORE', 'sqlite')).lower()
+    return backend == 'memory' or (backend == 'redis' and not os.environ.get('REDIS_URL'))
+
+
+def create_cart_store(backend=None, ttl=86400):
+    """Build the cart store selected by ``backend`` or ``CART_STORE``."""
+    backend = (backend or os.environ.get('CART_STORE', 'sqlite')).lower()
+
+    if backend == 'sqlite':
+        return SQLiteCartStore(os.environ.get('CART_STORE_PATH', 'carts.db'), ttl=ttl)
+
+    if backend == 'memory':
+        return MemoryCartStore(ttl=ttl, max_carts=int(os.environ.get('CART_STORE_MAX_CARTS', '10000')))
+
+    if backend == 'redis':
+        redis_url = os.environ.get('REDIS_URL')
+        if not redis_url:
+            log.warning('cart_store_local_redis')
+            return RedisCartStore(LocalRedis(), ttl=ttl)
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CART_STORE=redis needs the redis package. Please run: pip install redis")
+        return RedisCartStore(redis.Redis.from_url(redis_url), ttl=ttl)
+
+    raise ValueError(f"Unknown CART_STORE: {backend}")
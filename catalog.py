@@ -0,0 +1,130 @@
+"""TTL cache in front of the ``food-items`` table.
+
+The menu barely changes during a sale, so routes look items up here instead
+of querying Supabase on every request. Entries expire after ``ttl`` seconds
+and :meth:`MenuCatalog.invalidate` drops everything at once (for example
+after the menu is edited in the Supabase dashboard).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class MenuCatalog:
+    """Bounded id -> item and name -> item index over ``food-items``.
+
+    ``load_all`` returns every menu row ordered by id and ``load_by_ids``
+    returns the rows for a list of ids. Items handed out are copies, so
+    callers are free to annotate them (``remaining``, ``out_of_stock``...).
+    """
+
+    def __init__(self, load_all, load_by_ids, ttl=60, max_items=500):
+        self._load_all = load_all
+        self._load_by_ids = load_by_ids
+        self._ttl = ttl
+        self._max_items = max_items
+        self._lock = threading.Lock()
+        self._by_id = OrderedDict()  # item_id -> (item, expires_at)
+        self._listing = None  # (item_ids, expires_at) of the last full load
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def all_items(self):
+        """Every menu item ordered by id."""
+        now = time.monotonic()
+        with self._lock:
+            if self._listing is not None and self._listing[1] > now:
+                items = [self._by_id[item_id][0] for item_id in self._listing[0] if item_id in self._by_id]
+                if len(items) == len(self._listing[0]):
+                    self.hits += 1
+                    return [dict(item) for item in items]
+            self.misses += 1
+            version = self.version
+
+        items = self._load_all()
+
+        with self._lock:
+            # Don't let a load that raced with invalidate() repopulate the cache
+            if version == self.version:
+                expires_at = time.monotonic() + self._ttl
+                for item in items:
+                    self._store(item, expires_at)
+                if len(items) <= self._max_items:
+                    self._listing = ([item['id'] for item in items], expires_at)
+        return [dict(item) for item in items]
+
+    def get(self, item_id):
+        return self.get_many([item_id]).get(item_id)
+
+    def get_many(self, item_ids):
+        """``{item_id: item}`` for the given ids, fetching all misses in one query.
+
+        Results are keyed by the ids exactly as passed in, so string cart keys
+        map straight back to their items.
+        """
+        now = time.monotonic()
+        found = {}
+        missing = {}  # normalised key -> ids as the caller spelled them
+        with self._lock:
+            for item_id in item_ids:
+                key = self._key(item_id)
+                entry = self._by_id.get(key)
+                if entry is not None and entry[1] > now:
+                    self._by_id.move_to_end(key)
+                    found[item_id] = dict(entry[0])
+                    self.hits += 1
+                else:
+                    if key not in missing:
+                        self.misses += 1
+                    missing.setdefault(key, []).append(item_id)
+            version = self.version
+
+        if missing:
+            items = self._load_by_ids(list(missing))
+            with self._lock:
+                expires_at = time.monotonic() + self._ttl
+                for item in items:
+                    if version == self.version:
+                        self._store(item, expires_at)
+                    for item_id in missing.get(self._key(item['id']), []):
+                        found[item_id] = dict(item)
+        return found
+
+    def by_name(self, name):
+        return self.name_index().get(name)
+
+    def name_index(self):
+        """``{name: item}`` for the whole menu."""
+        return {item['name']: item for item in self.all_items()}
+
+    def invalidate(self):
+        with self._lock:
+            self._by_id.clear()
+            self._listing = None
+            self.version += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'size': len(self._by_id),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def _store(self, item, expires_at):
+        key = self._key(item['id'])
+        self._by_id[key] = (item, expires_at)
+        self._by_id.move_to_end(key)
+        while len(self._by_id) > self._max_items:
+            self._by_id.popitem(last=False)
+
+    @staticmethod
+    def _key(item_id):
+        # Cart keys arrive as strings from the browser, ids come back as ints
+        if isinstance(item_id, str) and item_id.isdigit():
+            return int(item_id)
+        return item_id
@@ -0,0 +1,77 @@
+"""gzip and brotli encoding of responses.
+
+:func:`compress_response` runs after every request and encodes HTML, JSON
+and other text bodies above ``min_size`` bytes with the best encoding the
+client accepts. Brotli is used when the optional ``brotli`` package is
+installed (``pip install brotli``), gzip otherwise.
+
+Bodies that are already encoded (cached pages, precompressed static files),
+streamed (``/stock/stream``) or sent from a file (exports) are left alone.
+"""
+import gzip
+import importlib.util
+
+BROTLI_AVAILABLE = importlib.util.find_spec('brotli') is not None
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+}
+
+# Fast settings for bodies encoded per request; precompressed ones use the maximum
+DYNAMIC_LEVELS = {'br': 4, 'gzip': 6}
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+
+
+def accepted_encoding(accept_encodings):
+    """``'br'``, ``'gzip'`` or None for a request's ``Accept-Encoding``."""
+    if BROTLI_AVAILABLE and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level=None):
+    if level is None:
+        level = DYNAMIC_LEVELS[encoding]
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=level)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_response(response, request, min_size=500):
+    """Encode ``response`` in place if it is worth it and the client can take it."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    encoded = compress(data, encoding)
+    if len(encoded) >= len(data):
+        return response
+    response.set_data(encoded)
+    response.headers['Content-Encoding'] = encoding
+    # The encoded body isn't byte-for-byte what a strong ETag promised
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,100 @@
+"""Order exports that stream rows instead of building the dataset in memory.
+
+Both writers take an iterator of order rows (normally
+``repository.iter_orders()``, which pages through ``order-list`` by keyset)
+and build the per-item Summary in the same pass, so memory stays flat no
+matter how many orders there are.
+"""
+import csv
+import io
+
+from order_items import format_items_text, order_line_items, order_total
+
+ORDER_HEADERS = ['Order ID', 'Customer Name', 'Phone', 'Items', 'Quantity', 'Membership', 'Total Amount (KD)']
+SUMMARY_HEADERS = ['Item', 'Quantity Ordered']
+
+# Rows buffered per chunk of a streamed CSV response
+CSV_CHUNK_ROWS = 500
+
+
+def _export_rows(orders, name_index, item_summary):
+    """Yield one spreadsheet row per order, tallying ``item_summary`` as it goes."""
+    for order in orders:
+        if not isinstance(order, dict):
+            continue
+        line_items = order_line_items(order, name_index)
+        for line in line_items:
+            item_summary[line['name']] = item_summary.get(line['name'], 0) + line['quantity']
+
+        yield [
+            order.get('order_id', ''),
+            order.get('customer_name', ''),
+            order.get('phone', ''),
+            order.get('item') or format_items_text(line_items),
+            order.get('quantity', ''),
+            order.get('membership', ''),
+            round(order_total(line_items), 3),
+        ]
+
+
+def _summary_rows(item_summary):
+    rows = [[item, quantity] for item, quantity in item_summary.items()]
+    rows.append(['TOTAL', sum(item_summary.values())])
+    return rows
+
+
+def write_xlsx(path, orders, name_index):
+    """Write the Orders and Summary sheets to ``path`` in constant memory mode."""
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        header_format = workbook.add_format({'bold': True, 'bg_color': '#333333', 'font_color': 'white'})
+        total_format = workbook.add_format({'bold': True, 'bg_color': '#DDDDDD'})
+
+        # constant_memory flushes each row once the next one starts, so rows
+        # have to be written strictly top to bottom
+        worksheet = workbook.add_worksheet('Orders')
+        worksheet.write_row(0, 0, ORDER_HEADERS, header_format)
+        item_summary = {}
+        row_number = 0
+        for row_number, row in enumerate(_export_rows(orders, name_index, item_summary), start=1):
+            # Snowflake order ids are past 2**53, where Excel's doubles start
+            # rounding, so they go in as text
+            order_id, *rest = row
+            worksheet.write_string(row_number, 0, str(order_id))
+            worksheet.write_row(row_number, 1, rest)
+        if row_number == 0:
+            worksheet.write(1, 0, 'No orders found')
+
+        worksheet = workbook.add_worksheet('Summary')
+        worksheet.write_row(0, 0, SUMMARY_HEADERS, header_format)
+        summary = _summary_rows(item_summary)
+        for row_number, row in enumerate(summary, start=1):
+            worksheet.write_row(row_number, 0, row, total_format if row_number == len(summary) else None)
+    finally:
+        workbook.close()
+
+
+def iter_csv(orders, name_index):
+    """Yield a CSV export in chunks: the orders, a blank line, then the summary."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return chunk
+
+    writer.writerow(ORDER_HEADERS)
+    item_summary = {}
+    for count, row in enumerate(_export_rows(orders, name_index, item_summary), start=1):
+        writer.writerow(row)
+        if count % CSV_CHUNK_ROWS == 0:
+            yield drain()
+
+    writer.writerow([])
+    writer.writerow(SUMMARY_HEADERS)
+    writer.writerows(_summary_rows(item_summary))
+    yield drain()
@@ -0,0 +1,53 @@
+"""gunicorn settings, picked up automatically by ``gunicorn main:app``."""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+
+# Every open /stock/stream connection holds a thread
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Import the app once in the master so workers share it copy-on-write;
+# backend clients are still created per worker after the fork
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def on_starting(server):
+    """Start-up checks and settings, run once in the master."""
+    from dotenv import load_dotenv
+    from cart_store import is_per_process
+    from shared_state import SharedState, bookings_closed_setting
+
+    load_dotenv()
+
+    # Each worker would only see the carts it served itself
+    if server.cfg.workers > 1 and is_per_process():
+        raise RuntimeError("CART_STORE keeps carts per process; use CART_STORE=sqlite (or redis with REDIS_URL) "
+                           "or run a single worker (WEB_CONCURRENCY=1)")
+
+    # Write-behind checks stock against one worker's ledger, so two workers
+    # could both confirm the last units before either order is flushed
+    if server.cfg.workers > 1 and os.environ.get('ORDER_WRITE_BEHIND', 'false').lower() == 'true':
+        raise RuntimeError("ORDER_WRITE_BEHIND needs a single worker (WEB_CONCURRENCY=1); "
+                           "switch it off to run several")
+
+    # An explicit BOOKINGS_CLOSED wins over the status the last run left in
+    # the shared state file. Done here rather than in the workers, so a worker
+    # restarting mid-sale doesn't undo an admin's toggle.
+    closed = bookings_closed_setting()
+    if closed is not None:
+        SharedState(os.environ.get('SHARED_STATE_PATH', 'shared_state.bin')).set_bookings_closed(closed)
+
+
+def pre_fork(server, worker):
+    """Give each worker the lowest order id slot no live worker holds."""
+    taken = {getattr(sibling, 'order_id_slot', None) for sibling in server.WORKERS.values()}
+    worker.order_id_slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+
+def post_fork(server, worker):
+    """Hand the new worker its slot as ``ORDER_WORKER_ID`` (see order_ids.py)."""
+    # Two workers sharing a worker id could hand out the same order id in the
+    # same millisecond. An ORDER_WORKER_ID set for the host is the first slot.
+    os.environ['ORDER_WORKER_ID'] = str(int(os.environ.get('ORDER_WORKER_ID', '0')) + worker.order_id_slot)
@@ -1,37 +1,61 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from flask import Blueprint, Flask, render_template, request, redirect, url_for, jsonify, session, g
+from flask import Response, stream_with_context
+import hashlib
+import importlib.util
+import itertools
+import json
+import logging
+import math
 import os
-from supabase import create_client
+import tempfile
+import threading
+import time
 from datetime import datetime
+from urllib.parse import urlencode
 from dotenv import load_dotenv
-from io import BytesIO
 from flask import send_file
+from admission import ConcurrencyLimiter, RateLimiter, WaitingRoom
+from app_logging import configure_logging, dropped_records, new_request_id, request_id_var
+from cart_operations import apply_cart_operations, parse_operations
+from cart_store import create_cart_store, new_cart_id
+from catalog import MenuCatalog
+from compression import accepted_encoding, compress_response
+from export import iter_csv, write_xlsx
+from metrics import MetricsRegistry, instrument
+from order_journal import OrderFlusher, OrderJournal
+from order_ids import OrderIdGenerator, order_id_timestamp
+from order_items import build_line_items, count_ordered_items, format_items_text, order_line_items, order_total
+from page_cache import PageCache
+from query_pool import QueryPool
+from reservation import InsufficientStock, check_line_quantities, requested_quantities
+from sales import SaleCalendar, format_sale_date, is_open
+from shared_state import SharedState, bookings_closed_setting
+from static_assets import StaticAssets
+from stock_events import StockBroadcaster
+from stock_ledger import StockLedger
+from storage import REPOSITORY_OPERATIONS, create_repository
 
-try:
-    import pandas as pd
-    
-    # Check if xlsxwriter is available
-    EXCEL_ENGINE = None
-    try:
-        import xlsxwriter
-        EXCEL_ENGINE = 'xlsxwriter'
-    except ImportError:
-        pass
-            
-except ImportError:
-    pd = None
-    EXCEL_ENGINE = None
+# Check if xlsxwriter is available without importing it; export.py only
+# loads it when an export is actually requested
+EXCEL_ENGINE = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else None
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
+# JSON logs written off the request thread; add-to-cart clicks are sampled
+configure_logging(sample_rates={'cart_item_added': float(os.environ.get('CART_LOG_SAMPLE_RATE', '0.1'))})
+log = logging.getLogger('moms')
+
+# Routes live on a blueprint so create_app() can build the Flask app
+store = Blueprint('store', __name__)
 
-SUPABASE_URL = os.environ.get('SUPA_URL')
-SUPABASE_KEY = os.environ.get('SUPA_KEY')
+# Bookings status from the environment, or None when unset; an explicit
+# value is applied every time the server starts
+BOOKINGS_CLOSED = bookings_closed_setting()
 
-# Default value for bookings status
-BOOKINGS_CLOSED = os.environ.get('BOOKINGS_CLOSED', 'false').lower() == 'true'
+# Bookings status and cache epochs shared by every worker on this host
+shared_state = SharedState(os.environ.get('SHARED_STATE_PATH', 'shared_state.bin'),
+                           bookings_closed=bool(BOOKINGS_CLOSED))
 
 # Google API configuration
 CLIENT_SECRETS_FILE = os.environ.get('GOOGLE_CLIENT_SECRETS_FILE', 'client_secret.json')
@@ -40,232 +64,593 @@ API_SERVICE_NAME = 'sheets'
 API_VERSION = 'v4'
 REDIRECT_URI = os.environ.get('REDIRECT_URI', 'http://localhost:5000/oauth2callback')
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Supabase by default; STORAGE_BACKEND=sqlite runs everything against a local database
+repository = create_repository()
+
+# Prometheus metrics served at /metrics
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram('moms_request_seconds', 'Time spent handling a request.',
+                                    ('route', 'method', 'status'))
+backend_seconds = metrics.histogram('moms_backend_call_seconds', 'Time spent in storage backend calls.',
+                                    ('table', 'operation', 'outcome'))
+orders_placed = metrics.counter('moms_orders_placed', 'Orders accepted.', ('mode',))
+stock_rejections = metrics.counter('moms_stock_rejections', 'Orders refused because an item ran out.')
+admission_rejections = metrics.counter('moms_admission_rejections', 'Storefront requests turned away by admission control.',
+                                       ('reason',))
+
+# Time every Supabase query before anything else holds on to a repository method
+instrument(repository, REPOSITORY_OPERATIONS, backend_seconds)
+
+# Threads per worker for running a page's independent queries side by side (0 runs them in turn)
+query_pool = QueryPool(max_workers=int(os.environ.get('QUERY_POOL_SIZE', '4')))
+
+# Optional write-behind: confirm orders from a local journal and store them in batches
+ORDER_WRITE_BEHIND = os.environ.get('ORDER_WRITE_BEHIND', 'false').lower() == 'true'
+
+order_journal = None
+order_flusher = None
+if ORDER_WRITE_BEHIND:
+    order_journal = OrderJournal(os.environ.get('ORDER_JOURNAL_PATH', 'order_journal.db'))
+    order_flusher = OrderFlusher(order_journal, repository,
+                                 batch_size=int(os.environ.get('ORDER_FLUSH_BATCH', '100')),
+                                 interval=float(os.environ.get('ORDER_FLUSH_INTERVAL', '0.5')))
+    # Replays whatever a previous run left in the journal
+    order_flusher.ensure_running()
+
+# Serialises the ledger check and journal append in write-behind mode, which
+# gunicorn.conf.py only allows with a single worker
+write_behind_lock = threading.Lock()
+
+# Stock, the admin page and exports are scoped to the current sale; sales
+# are re-read this often to notice one opening
+SALE_CACHE_SECONDS = int(os.environ.get('SALE_CACHE_SECONDS', '30'))
+
+sale_calendar = SaleCalendar(repository.list_sales, ttl=SALE_CACHE_SECONDS)
+
+# How often each worker re-reads order-list to pick up orders from other workers
+STOCK_RECONCILE_SECONDS = int(os.environ.get('STOCK_RECONCILE_SECONDS', '30'))
+
+def load_all_orders():
+    """Every order of the current sale"""
+    sale_id = sale_calendar.current_id()
+    # Read the journal first: an order flushed in between then shows up in
+    # order-list instead of being missed by both reads
+    pending = order_journal.pending_orders() if order_journal is not None else []
+    pending = [order for order in pending if order.get('sale_id') == sale_id]
+    orders = list(repository.iter_orders(sale_id=sale_id))
+    stored = {order['order_id'] for order in orders}
+    return orders + [order for order in pending if order['order_id'] not in stored]
+
+stock_ledger = StockLedger(load_all_orders, reconcile_interval=STOCK_RECONCILE_SECONDS)
+
+# How long menu items are served from memory before being re-read from food-items
+MENU_CACHE_SECONDS = int(os.environ.get('MENU_CACHE_SECONDS', '60'))
+
+def load_menu():
+    return repository.list_food_items(sale_id=sale_calendar.current_id())
+
+def load_menu_items(item_ids):
+    return repository.get_food_items(item_ids, sale_id=sale_calendar.current_id())
+
+menu_catalog = MenuCatalog(load_menu, load_menu_items, ttl=MENU_CACHE_SECONDS)
+
+def start_new_sale(sale):
+    # Cached stock and ordered totals belong to the previous sale
+    log.info('sale_changed', extra={'sale_id': sale['id'] if sale else None})
+    menu_catalog.invalidate()
+    stock_ledger.clear()
+    stock_ledger.invalidate()
+
+sale_calendar.add_listener(start_new_sale)
+
+# Carts live server-side; the session cookie only carries their id
+CART_TTL_SECONDS = int(os.environ.get('CART_TTL_SECONDS', '86400'))
+
+cart_store = create_cart_store(ttl=CART_TTL_SECONDS)
+
+# Seconds between keepalives on /stock/stream (also how often idle streams reconcile)
+STOCK_STREAM_KEEPALIVE = int(os.environ.get('STOCK_STREAM_KEEPALIVE', '15'))
+
+# Each open stream holds a request thread, so only a quarter of them may be
+# streams; storefronts turned away poll /api/stock every STOCK_POLL_SECONDS
+STOCK_STREAM_MAX = int(os.environ.get('STOCK_STREAM_MAX', max(1, int(os.environ.get('GUNICORN_THREADS', '8')) // 4)))
+STOCK_POLL_SECONDS = int(os.environ.get('STOCK_POLL_SECONDS', '5'))
 
-# Initialize cart in session
-@app.before_request
+stock_broadcaster = StockBroadcaster(refresh=stock_ledger.snapshot, keepalive=STOCK_STREAM_KEEPALIVE,
+                                     max_subscribers=STOCK_STREAM_MAX)
+
+def stock_status(items, ordered):
+    """``{item_id: {remaining, out_of_stock}}`` for menu items given ordered totals by name."""
+    status = {}
+    for item in items:
+        remaining = item.get('quantity', 0) - ordered.get(item['name'], 0)
+        status[item['id']] = {'remaining': remaining, 'out_of_stock': remaining <= 0}
+    return status
+
+def publish_stock_changes(changed):
+    # Skip the menu lookup when no storefront is listening
+    if not stock_broadcaster.subscriber_count:
+        return
+    name_index = menu_catalog.name_index()
+    stock_broadcaster.publish(stock_status(
+        [name_index[name] for name in changed if name in name_index], changed))
+
+stock_ledger.add_listener(publish_stock_changes)
+
+# Rendered storefront: reused for at least HOME_CACHE_SECONDS, and served stale
+# for up to HOME_STALE_SECONDS more while one request re-renders it
+HOME_CACHE_SECONDS = float(os.environ.get('HOME_CACHE_SECONDS', '1'))
+HOME_STALE_SECONDS = float(os.environ.get('HOME_STALE_SECONDS', '10'))
+
+page_cache = PageCache(ttl=HOME_CACHE_SECONDS, stale_ttl=HOME_STALE_SECONDS, max_age=MENU_CACHE_SECONDS)
+
+# Responses smaller than this aren't worth compressing
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '500'))
+
+# Admission control in front of the storefront: per-client token buckets on
+# cart and order posts, and a cap on concurrent backend-heavy requests (per worker)
+cart_limiter = RateLimiter(float(os.environ.get('CART_RATE_LIMIT', '5')),
+                           int(os.environ.get('CART_RATE_BURST', '20')))
+order_limiter = RateLimiter(float(os.environ.get('ORDER_RATE_LIMIT', '0.2')),
+                            int(os.environ.get('ORDER_RATE_BURST', '3')))
+backend_limiter = ConcurrencyLimiter(int(os.environ.get('BACKEND_CONCURRENCY', '4')),
+                                     timeout=float(os.environ.get('BACKEND_QUEUE_TIMEOUT', '2')))
+
+RATE_LIMITS = {
+    'store.add_to_cart': cart_limiter,
+    'store.update_cart': cart_limiter,
+    'store.cart_batch': cart_limiter,
+    'store.place_order': order_limiter,
+}
+BACKEND_HEAVY_ENDPOINTS = {'store.place_order'}
+
+# Optional waiting room letting new visitors in at WAITING_ROOM_RATE per second,
+# in arrival order across every worker on the host (0 turns it off)
+WAITING_ROOM_RATE = float(os.environ.get('WAITING_ROOM_RATE', '0'))
+
+waiting_room = None
+if WAITING_ROOM_RATE > 0:
+    waiting_room = WaitingRoom(WAITING_ROOM_RATE, burst=int(os.environ.get('WAITING_ROOM_BURST', '50')),
+                               claim_slot=shared_state.claim_queue_slot)
+
+# Query parameter marking the redirect that hands a new visitor a session
+SESSION_CHECK_PARAM = 'session_check'
+
+QUEUED_ENDPOINTS = {'store.home', 'store.add_to_cart', 'store.get_cart', 'store.update_cart',
+                    'store.cart_batch', 'store.checkout', 'store.place_order'}
+
+# How long browsers and proxies may reuse an /api/stock response without revalidating
+STOCK_API_MAX_AGE = int(os.environ.get('STOCK_API_MAX_AGE', '2'))
+
+# Snowflake-style IDs: unique across workers and still sortable by time
+order_id_generator = OrderIdGenerator()
+
+# Orders copied to order-archive per request when clearing in archive mode
+CLEAR_BATCH_SIZE = int(os.environ.get('CLEAR_BATCH_SIZE', '500'))
+
+# Orders shown per page on the admin dashboard
+ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', '50'))
+
+# Orders fetched per page while streaming an export
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '1000'))
+
+metrics.gauge('moms_menu_cache_lookups', 'Menu catalog lookups by result.',
+              lambda: {('hit',): menu_catalog.hits, ('miss',): menu_catalog.misses}, ('result',))
+metrics.gauge('moms_menu_cache_hit_ratio', 'Share of menu catalog lookups served from memory.',
+              lambda: menu_catalog.stats()['hit_rate'])
+metrics.gauge('moms_page_cache_lookups', 'Rendered page lookups by result.',
+              lambda: {('hit',): page_cache.hits, ('stale',): page_cache.stale_hits,
+                       ('render',): page_cache.renders}, ('result',))
+metrics.gauge('moms_backend_requests_in_flight', 'Backend-heavy storefront requests being served.',
+              lambda: backend_limiter.in_flight)
+metrics.gauge('moms_stock_stream_clients', 'Open /stock/stream connections.',
+              lambda: stock_broadcaster.subscriber_count)
+metrics.gauge('moms_order_journal_depth', 'Orders waiting in the write-behind journal.',
+              lambda: order_journal.stats()['depth'] if order_journal is not None else None)
+metrics.gauge('moms_log_records_dropped', 'Log records dropped because the log queue was full.',
+              dropped_records)
+metrics.gauge('moms_order_journal_lag_seconds', 'Age of the oldest order waiting in the journal.',
+              lambda: order_journal.stats()['lag_seconds'] if order_journal is not None else None)
+
+@store.before_app_request
 def before_request():
-    if 'cart' not in session:
-        session['cart'] = {}
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or new_request_id()
+    request_id_var.set(g.request_id)
+    # Threads don't survive a fork, so each gunicorn worker starts its own flusher
+    if order_flusher is not None:
+        order_flusher.ensure_running()
+    apply_shared_changes()
+    return admit_request()
 
-@app.route('/')
-def home():
-    if BOOKINGS_CLOSED:
-        return redirect(url_for('bookings_closed'))
+def apply_shared_changes():
+    """Drop caches another worker has invalidated since this one last checked"""
+    changed = shared_state.changes()
+    if 'menu_epoch' in changed:
+        sale_calendar.invalidate()
+        menu_catalog.invalidate()
+    if 'stock_epoch' in changed:
+        stock_ledger.invalidate()
+
+def admit_request():
+    """Turn the request away (returning the response to send) if admission control says so"""
+    endpoint = request.endpoint
+    limiter = RATE_LIMITS.get(endpoint)
+    # Reading the session adds Vary: Cookie, which would keep proxies from
+    # caching /api/stock and static files, so only queued or rate-limited
+    # endpoints look at it
+    if endpoint in QUEUED_ENDPOINTS or limiter is not None:
+        # Only ever set on a response, so having one means the client kept its cookie
+        client_id = session.get('cart_id')
+        # Hand one out on the first storefront request, so a visitor already has
+        # their own rate-limit bucket by the time they add to the cart
+        if client_id is None:
+            session['cart_id'] = new_cart_id()
         
-    # Get food items from Supabase
-    response = supabase.table('food-items').select('*').order('id').execute()
-    food_items = response.data
+        if waiting_room is not None and endpoint in QUEUED_ENDPOINTS and not session.get('admitted'):
+            if not shared_state.get('bookings_closed'):
+                if client_id is None:
+                    return require_session()
+                admit_at = session.get('admit_at')
+                if admit_at is None:
+                    admit_at = session['admit_at'] = waiting_room.claim()
+                if admit_at > time.time():
+                    return waiting_room_response(admit_at)
+                session.pop('admit_at', None)
+                session['admitted'] = True
+        
+        if limiter is not None:
+            # Key on the visitor's cart id so visitors behind one address (or a
+            # proxy) don't share a bucket. A request without one is keyed on the
+            # address, so a client that drops cookies can't start a fresh bucket
+            # each time; one that keeps them has its own bucket from the next request.
+            retry_after = limiter.allow(client_id or f'addr:{request.remote_addr}')
+            if retry_after:
+                return reject_request('rate_limited', 429, retry_after,
+                                      "You're going a little fast. Please wait a moment and try again.")
     
-    # Calculate ordered quantities from order-list
-    try:
-        orders_response = supabase.table('order-list').select('*').execute()
-        orders = orders_response.data
+    if endpoint in BACKEND_HEAVY_ENDPOINTS:
+        if not backend_limiter.acquire():
+            return reject_request('overloaded', 503, 1,
+                                  "We're very busy right now. Please try again in a few seconds.")
+        g.backend_slot = True
+
+def require_session():
+    """Have the session cookie (set by admit_request) sent back before queueing.
+    
+    A client that doesn't send it back would otherwise claim a new
+    waiting-room slot on every request and push everyone else's admission back.
+    """
+    if request.method == 'GET' and SESSION_CHECK_PARAM not in request.args:
+        query = list(request.args.items(multi=True)) + [(SESSION_CHECK_PARAM, '1')]
+        return redirect(f'{request.path}?{urlencode(query)}')
+    return reject_request('no_session', 403, None, "Please enable cookies to join the queue.")
+
+def waiting_room_response(admit_at):
+    admission_rejections.inc(reason='queued')
+    wait_seconds = math.ceil(admit_at - time.time())
+    refresh_seconds = min(max(wait_seconds, 1), 10)
+    if wants_json():
+        response = jsonify({'success': False, 'error': "You're in the queue; the menu will open shortly."})
+        response.status_code = 503
+    else:
+        response = Response(render_template('waiting_room.html', ahead=waiting_room.ahead_of(admit_at),
+                                            wait_seconds=wait_seconds, refresh_seconds=refresh_seconds))
+    response.headers['Retry-After'] = str(refresh_seconds)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def reject_request(reason, status, retry_after, message):
+    admission_rejections.inc(reason=reason)
+    log.info('request_rejected', extra={'reason': reason, 'endpoint': request.endpoint})
+    if wants_json():
+        response = jsonify({'success': False, 'error': message})
+    else:
+        response = Response(render_template('error.html', error=message))
+    response.status_code = status
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def wants_json():
+    # The storefront's fetch() calls post JSON, or read the cart
+    return request.is_json or request.endpoint == 'store.get_cart'
+
+@store.teardown_app_request
+def release_backend_slot(exc):
+    if g.pop('backend_slot', False):
+        backend_limiter.release()
+
+@store.after_app_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_seconds.observe(time.perf_counter() - started,
+                                route=route, method=request.method, status=response.status_code)
+    if g.get('request_id'):
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@store.after_app_request
+def optimize_response(response):
+    # Rendered pages get a weak ETag, so a reload of an unchanged page is a 304
+    if (response.status_code == 200 and response.mimetype == 'text/html' and not response.is_streamed
+            and not response.direct_passthrough and not response.get_etag()[0]):
+        response.add_etag(weak=True)
+        response = response.make_conditional(request)
+    return compress_response(response, request, min_size=COMPRESS_MIN_SIZE)
+
+@store.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def journal_order(order_data):
+    """Check stock against the ledger and queue the order for the background flusher"""
+    check_line_quantities(order_data['line_items'])
+    requested = requested_quantities(order_data['line_items'])
+    with write_behind_lock:
+        menu_items = menu_catalog.get_many(list(requested))
+        ordered_quantities = stock_ledger.snapshot()
         
-        ordered_quantities = {}
+        shortfalls = []
+        for item_id, quantity in requested.items():
+            item = menu_items.get(item_id)
+            available = item.get('quantity', 0) - ordered_quantities.get(item['name'], 0) if item else 0
+            if quantity > available:
+                name = item['name'] if item else str(item_id)
+                shortfalls.append({'item_id': item_id, 'name': name, 'requested': quantity, 'available': max(available, 0)})
+        if shortfalls:
+            raise InsufficientStock(shortfalls)
         
-        for order in orders:
-            if isinstance(order, dict):
-                if 'item' in order and isinstance(order['item'], str) and '(x' in order['item']:
-                    items_string = order['item']
-                    items_parts = items_string.split(', ')
-                    
-                    for item_part in items_parts:
-                        if '(x' in item_part:
-                            item_name_parts = item_part.split(' (x')
-                            if len(item_name_parts) >= 2:
-                                item_name = item_name_parts[0]
-                                try:
-                                    quantity_str = item_name_parts[1].rstrip(')')
-                                    quantity = int(quantity_str)
-                                except (ValueError, IndexError):
-                                    quantity = 1
-                                
-                                # Update ordered quantities
-                                if item_name in ordered_quantities:
-                                    ordered_quantities[item_name] += quantity
-                                else:
-                                    ordered_quantities[item_name] = quantity
-                
-                elif 'item' in order and not isinstance(order['item'], list):
-                    item_name = str(order['item'])
-                    try:
-                        quantity = int(order.get('quantity', 1))
-                    except (ValueError, TypeError):
-                        quantity = 1
-                    
-                    if item_name in ordered_quantities:
-                        ordered_quantities[item_name] += quantity
-                    else:
-                        ordered_quantities[item_name] = quantity
+        order_journal.append(order_data)
+        stock_ledger.record(count_ordered_items([order_data]))
+    
+    order_flusher.notify()
+    return dict(order_data)
+
+def get_cart_quantities():
+    """The visitor's cart as ``{item_id: quantity}``"""
+    cart_id = session.get('cart_id')
+    return cart_store.get(cart_id) if cart_id else {}
+
+def save_cart_quantities(cart):
+    cart_id = session.get('cart_id')
+    if cart_id is None:
+        if not cart:
+            return
+        # Only visitors who actually add something get a cart (and a cookie)
+        cart_id = session['cart_id'] = new_cart_id()
+    cart_store.save(cart_id, cart)
+
+def resolve_cart(cart, menu_items=None):
+    """Cart lines with name, price and image filled in from the menu catalog"""
+    if menu_items is None:
+        menu_items = menu_catalog.get_many(list(cart.keys()))
+    return {
+        item_id: {
+            'name': menu_items[item_id]['name'],
+            'price': menu_items[item_id]['price'],
+            'quantity': quantity,
+            'image': menu_items[item_id].get('image'),
+        }
+        for item_id, quantity in cart.items() if item_id in menu_items
+    }
+
+@store.route('/')
+def home():
+    sale = sale_calendar.current()
+    if shared_state.get('bookings_closed') or not is_open(sale):
+        return redirect(url_for('store.bookings_closed'))
         
+    # A fresh worker has neither the ordered totals nor the menu yet; load
+    # them side by side rather than one round trip after the other
+    if not stock_ledger.seeded:
+        try:
+            query_pool.gather(menu_catalog.all_items, stock_ledger.snapshot)
+        except Exception:
+            log.exception('stock_status_failed')
+    
+    # Everyone sees the same page until the sale, the menu or the stock moves on
+    try:
+        version = (sale['id'], menu_catalog.version, stock_ledger.version)
+    except Exception:
+        log.exception('stock_status_failed')
+        version = None
+    
+    page = page_cache.get('home', version, lambda: render_home(sale))
+    
+    # Compressed once per render rather than on every request
+    encoding = accepted_encoding(request.accept_encodings) if len(page.body) >= COMPRESS_MIN_SIZE else None
+    response = Response(page.encode(encoding) if encoding else page.body, mimetype='text/html')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(page.etag, weak=True)
+    return response.make_conditional(request)
+
+def render_home(sale):
+    # Get food items from the menu catalog
+    food_items = menu_catalog.all_items()
+    
+    # Work out remaining stock from the in-process ledger
+    try:
         for item in food_items:
-            item_name = item['name']
-            inventory_quantity = item.get('quantity', 0)
-            ordered = ordered_quantities.get(item_name, 0)
-            remaining = inventory_quantity - ordered
+            remaining = stock_ledger.remaining(item)
             item['remaining'] = remaining
             item['out_of_stock'] = remaining <= 0 # Mark as out of stock if remaining is less than or equal to 0
         
-    except Exception as e:
-        print(f"Error calculating stock status: {str(e)}")
+    except Exception:
+        log.exception('stock_status_failed')
         for item in food_items:
             item['out_of_stock'] = False
     
-    # Sale date
-    sale_date = "May 31, 2025"
+    return render_template('home.html', food_items=food_items, sale_date=format_sale_date(sale),
+                           stock_poll_seconds=STOCK_POLL_SECONDS)
+
+@store.route('/stock/stream')
+def stock_stream():
+    """Server-Sent Events feed of remaining stock for the storefront"""
+    subscription = stock_broadcaster.subscribe()
+    if subscription is None:
+        # EventSource gives up on a 503 and the page falls back to polling
+        admission_rejections.inc(reason='streams_full')
+        return Response('Too many open stock streams; poll /api/stock instead.\n', status=503,
+                        mimetype='text/plain', headers={'Retry-After': str(STOCK_POLL_SECONDS)})
+    
+    # Start every connection with the full picture so reconnects catch up
+    try:
+        snapshot = stock_status(menu_catalog.all_items(), stock_ledger.snapshot())
+    except Exception:
+        log.exception('stock_snapshot_failed')
+        snapshot = None
+    
+    return Response(
+        stock_broadcaster.stream(subscription, snapshot),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@store.route('/api/stock')
+def api_stock():
+    """Remaining units per item id, with an ETag for conditional polling"""
+    try:
+        status = stock_status(menu_catalog.all_items(), stock_ledger.snapshot())
+    except Exception as e:
+        log.exception('stock_status_failed')
+        return jsonify({'error': str(e)}), 500
+    
+    body = json.dumps({item_id: max(stock['remaining'], 0) for item_id, stock in status.items()},
+                      separators=(',', ':'))
     
-    return render_template('home.html', food_items=food_items, sale_date=sale_date)
+    # Tag the content rather than a per-worker counter, so every worker hands
+    # out the same ETag for the same stock and a proxy can revalidate anywhere
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body.encode()).hexdigest()[:16])
+    response.headers['Cache-Control'] = f'public, max-age={STOCK_API_MAX_AGE}'
+    return response.make_conditional(request)
 
-@app.route('/add_to_cart', methods=['POST'])
+@store.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
-    data = request.json
-    item_id = data.get('item_id')
-    requested_quantity = data.get('quantity', 1)
+    # Validated the same way as a one-operation /cart/batch
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': "Expected a JSON object"}), 400
+    try:
+        [(_, item_id, requested_quantity)] = parse_operations({'operations': [dict(data, op='add')]})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     try:
-        response = supabase.table('food-items').select('*').eq('id', item_id).execute()
-        print(f"Response from Supabase for item_id {item_id}: {response}")
-        item = response.data[0] if response.data else None
-        
-        if item:
-            # Check stock availability
-            item_name = item['name']
-            inventory_quantity = item.get('quantity', 0)
-            
-            # Get all orders to calculate current ordered quantity
-            orders_response = supabase.table('order-list').select('*').execute()
-            orders = orders_response.data
-            
-            # Calculate already ordered quantity
-            ordered_quantity = 0
-            for order in orders:
-                if isinstance(order, dict) and 'item' in order and isinstance(order['item'], str):
-                    if item_name in order['item']:
-                        # Try to extract the specific quantity for this item
-                        if f"{item_name} (x" in order['item']:
-                            items_string = order['item']
-                            items_parts = items_string.split(', ')
-                            
-                            for item_part in items_parts:
-                                if item_name in item_part and '(x' in item_part:
-                                    item_name_parts = item_part.split(' (x')
-                                    if len(item_name_parts) >= 2 and item_name_parts[0] == item_name:
-                                        try:
-                                            quantity_str = item_name_parts[1].rstrip(')')
-                                            ordered_quantity += int(quantity_str)
-                                        except (ValueError, IndexError):
-                                            pass
-            
-            if item_id in session['cart']:
-                current_cart_quantity = session['cart'][item_id]['quantity']
-            else:
-                current_cart_quantity = 0
-            
-            available_stock = inventory_quantity - ordered_quantity
-            
-            can_add = available_stock - current_cart_quantity
-            
-            if can_add <= 0:
-                return jsonify({
-                    'success': False, 
-                    'error': 'This item is out of stock.'
-                })
-            
-            actual_quantity_to_add = min(requested_quantity, can_add)
-            
-            if item_id in session['cart']:
-                session['cart'][item_id]['quantity'] += actual_quantity_to_add
-            else:
-                session['cart'][item_id] = {
-                    'name': item['name'],
-                    'price': item['price'],
-                    'quantity': actual_quantity_to_add,
-                    'image': item['image']
-                }
-            session.modified = True
-            
-            if actual_quantity_to_add < requested_quantity:
-                return jsonify({
-                    'success': True, 
-                    'cart_size': len(session['cart']),
-                    'adjusted': True,
-                    'message': f'Only {actual_quantity_to_add} items were added due to stock limitations.'
-                })
-            else:
-                return jsonify({'success': True, 'cart_size': len(session['cart'])})
-        else:
-            print(f"Item with ID {item_id} not found in database")
+        cart = get_cart_quantities()
+        in_cart = cart.get(item_id, 0)
+        # Stock is checked the same way as for /cart/batch
+        adjustments = apply_cart_operations(cart, [('add', item_id, requested_quantity)],
+                                            menu_catalog.get_many([item_id]), stock_ledger.snapshot())
+        adjustment = adjustments[0] if adjustments else None
+        
+        if adjustment and adjustment['reason'] == 'not_found':
+            log.warning('cart_item_not_found', extra={'item_id': item_id})
             return jsonify({'success': False, 'error': 'Item not found'})
+        if adjustment and adjustment['reason'] == 'out_of_stock':
+            return jsonify({
+                'success': False, 
+                'error': 'This item is out of stock.'
+            })
+        
+        save_cart_quantities(cart)
+        log.info('cart_item_added', extra={'item_id': item_id, 'quantity': cart[item_id] - in_cart,
+                                           'requested': requested_quantity})
+        
+        if adjustment:
+            return jsonify({
+                'success': True, 
+                'cart_size': len(cart),
+                'adjusted': True,
+                'message': adjustment['message']
+            })
+        return jsonify({'success': True, 'cart_size': len(cart)})
+    except Exception as e:
+        log.exception('add_to_cart_failed', extra={'item_id': item_id})
+        return jsonify({'success': False, 'error': str(e)})
+
+@store.route('/cart/batch', methods=['POST'])
+def cart_batch():
+    """Apply a list of add/update/remove operations to the cart in one go.
+    
+    The storefront debounces clicks into one of these instead of a request
+    per click. Every operation is checked against one menu lookup and one
+    stock snapshot, the cart is saved once, and the response carries the
+    resulting cart plus whatever had to be cut back.
+    """
+    try:
+        operations = parse_operations(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        cart = get_cart_quantities()
+        menu_items = menu_catalog.get_many(list(set(cart) | {item_id for _, item_id, _ in operations}))
+        adjustments = apply_cart_operations(cart, operations, menu_items, stock_ledger.snapshot())
+        save_cart_quantities(cart)
+        log.info('cart_batch_applied', extra={'operations': len(operations), 'adjustments': len(adjustments),
+                                              'cart_size': len(cart)})
+        return jsonify({
+            'success': True,
+            'cart': resolve_cart(cart, menu_items),
+            'cart_size': len(cart),
+            'adjustments': adjustments,
+        })
     except Exception as e:
-        print(f"Error fetching item from Supabase: {str(e)}")
+        log.exception('cart_batch_failed')
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/get_cart')
+@store.route('/get_cart')
 def get_cart():
-    return jsonify(session['cart'])
+    return jsonify(resolve_cart(get_cart_quantities()))
 
-@app.route('/update_cart', methods=['POST'])
+@store.route('/update_cart', methods=['POST'])
 def update_cart():
-    data = request.json
-    item_id = data.get('item_id')
-    quantity = data.get('quantity', 0)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': "Expected a JSON object"}), 400
+    try:
+        [(_, item_id, quantity)] = parse_operations({'operations': [dict(data, op='update')]})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     try:
-        if item_id in session['cart']:
+        cart = get_cart_quantities()
+        if item_id in cart:
             if quantity <= 0:
-                session['cart'].pop(item_id)
+                cart.pop(item_id)
             else:
-                session['cart'][item_id]['quantity'] = quantity
-            session.modified = True
+                cart[item_id] = quantity
+            save_cart_quantities(cart)
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'Item not found in cart'})
     except Exception as e:
-        print(f"Error updating cart: {str(e)}")
+        log.exception('update_cart_failed', extra={'item_id': item_id})
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/checkout')
+@store.route('/checkout')
 def checkout():
     # Before displaying checkout, verify that all items are still in stock in sufficient quantities
     try:
-        cart = session.get('cart', {})
-        
-        # Get all active orders to calculate current stock levels
-        orders_response = supabase.table('order-list').select('*').execute()
-        orders = orders_response.data
+        cart = get_cart_quantities()
         
-        # Calculate ordered quantities for each item
-        ordered_quantities = {}
-        for order in orders:
-            if isinstance(order, dict) and 'item' in order and isinstance(order['item'], str) and '(x' in order['item']:
-                items_string = order['item']
-                items_parts = items_string.split(', ')
-                
-                for item_part in items_parts:
-                    if '(x' in item_part:
-                        item_name_parts = item_part.split(' (x')
-                        if len(item_name_parts) >= 2:
-                            item_name = item_name_parts[0]
-                            try:
-                                quantity_str = item_name_parts[1].rstrip(')')
-                                quantity = int(quantity_str)
-                                
-                                if item_name in ordered_quantities:
-                                    ordered_quantities[item_name] += quantity
-                                else:
-                                    ordered_quantities[item_name] = quantity
-                            except (ValueError, IndexError):
-                                pass
+        # One batched menu lookup and one stock snapshot for the whole cart
+        menu_items = menu_catalog.get_many(list(cart.keys()))
+        ordered_quantities = stock_ledger.snapshot()
         
         # Check if any cart item exceeds available stock
         cart_modified = False
         items_updated = []
         
-        for item_id, item_details in list(cart.items()):
-            item_response = supabase.table('food-items').select('*').eq('id', item_id).execute()
-            if item_response.data:
-                item = item_response.data[0]
+        for item_id, quantity in list(cart.items()):
+            item = menu_items.get(item_id)
+            if item:
                 inventory_quantity = item.get('quantity', 0)
                 item_name = item['name']
                 
@@ -274,57 +659,70 @@ def checkout():
                 max_allowed = inventory_quantity - ordered_quantity
                 
                 # If requested quantity exceeds maximum allowed, adjust it
-                if item_details['quantity'] > max_allowed:
+                if quantity > max_allowed:
                     if max_allowed <= 0:
-                        session['cart'].pop(item_id)
+                        cart.pop(item_id)
                         items_updated.append(f"{item_name} (removed - out of stock)")
                     else:
                         # Reduce quantity to maximum allowed
-                        session['cart'][item_id]['quantity'] = max_allowed
+                        cart[item_id] = max_allowed
                         items_updated.append(f"{item_name} (adjusted to {max_allowed})")
                     
                     cart_modified = True
         
         if cart_modified:
-            session.modified = True
+            save_cart_quantities(cart)
             flash_message = "Some items in your cart were adjusted due to stock limitations: " + ", ".join(items_updated)
             return render_template('checkout.html', cart_adjusted=True, adjustment_message=flash_message)
     
-    except Exception as e:
-        print(f"Error verifying cart: {str(e)}")
+    except Exception:
+        log.exception('checkout_verify_failed')
     
     return render_template('checkout.html')
 
-@app.route('/place_order', methods=['POST'])
+@store.route('/place_order', methods=['POST'])
 def place_order():
     try:
         customer_name = request.form.get('name')
         phone = request.form.get('phone')
         membership = request.form.get('membership', '')
         
-        order_id = int(datetime.now().timestamp())
+        order_id = order_id_generator.next_id()
+        
+        cart = get_cart_quantities()
+        log.debug('order_received', extra={'order_id': order_id, 'cart': cart})
         
-        print(f"Generated order ID: {order_id}")
-        print(f"Cart contents: {session.get('cart', {})}")
+        # Orders are only taken while the current sale is open
+        sale = sale_calendar.current()
+        if shared_state.get('bookings_closed') or not is_open(sale):
+            return redirect(url_for('store.bookings_closed'))
         
-        if not session.get('cart'):
+        if not cart:
             return render_template('error.html', error="Your cart is empty. Please add items before checkout.")
         
         try:
-            all_items = []
-            total_quantity = 0
-            
-            for item_id, item_data in session['cart'].items():
-                all_items.append(f"{item_data['name']} (x{item_data['quantity']})")
-                total_quantity += item_data['quantity']
-            
-            items_text = ", ".join(all_items)
+            # Every cart line has to be on the current sale's menu; dropping
+            # the rest would store (and confirm) a partial or empty order
+            menu_items = menu_catalog.get_many(list(cart.keys()))
+            unavailable = [item_id for item_id in cart if item_id not in menu_items]
+            line_items = build_line_items(resolve_cart(cart, menu_items))
+            if unavailable or not line_items:
+                for item_id in unavailable:
+                    cart.pop(item_id)
+                save_cart_quantities(cart)
+                log.warning('order_rejected_unavailable', extra={'order_id': order_id, 'item_ids': unavailable})
+                return render_template('error.html',
+                                     error="Some items in your cart are no longer available. Your cart has been updated.",
+                                     details="Please review your cart and place your order again.")
+            total_quantity = sum(line['quantity'] for line in line_items)
             
             order_data = {
                 'order_id': order_id,
                 'customer_name': customer_name,
-                'item': items_text,
+                'item': format_items_text(line_items),
+                'line_items': line_items,
                 'quantity': total_quantity,
+                'sale_id': sale['id'],
             }
             
             try:
@@ -337,138 +735,129 @@ def place_order():
             except (ValueError, TypeError):
                 order_data['membership'] = 0
             
-            print(f"Inserting order with consolidated data: {order_data}")
-            
-            # Insert the order into the database
-            insert_response = supabase.table('order-list').insert(order_data).execute()
-            print(f"Insert response: {insert_response}")
+            log.debug('order_payload', extra={'order_id': order_id, 'order': order_data})
             
-            if hasattr(insert_response, 'data') and insert_response.data:
+            # Reserve stock and insert the order in one atomic call, or queue
+            # it in the journal when running write-behind
+            try:
+                if order_journal is not None:
+                    inserted_order = journal_order(order_data)
+                else:
+                    inserted_order = repository.place_order(order_data)
+                    stock_ledger.record(count_ordered_items([order_data]))
+            except InsufficientStock as shortage:
+                stock_rejections.inc()
+                # Trim the cart to what is actually left so a retry can succeed
+                for shortfall in shortage.shortfalls:
+                    for item_id in list(cart):
+                        if str(item_id) == str(shortfall['item_id']):
+                            if shortfall['available'] > 0:
+                                cart[item_id] = shortfall['available']
+                            else:
+                                cart.pop(item_id)
+                save_cart_quantities(cart)
+                log.warning('order_rejected_stock', extra={'order_id': order_id, 'shortfalls': shortage.shortfalls})
+                return render_template('error.html', 
+                                     error="Some items sold out while you were checking out. Your cart has been updated.",
+                                     details=f"Not enough stock for: {shortage}")
+            if inserted_order:
+                orders_placed.inc(mode='journal' if order_journal is not None else 'atomic')
+                
                 # Clear the cart on successful order
-                session['cart'] = {}
-                print("Order placed successfully with JSON arrays")
+                save_cart_quantities({})
+                log.info('order_placed', extra={'order_id': order_id, 'lines': len(line_items),
+                                                'quantity': total_quantity, 'journaled': order_journal is not None})
                 return render_template('order_confirmation.html', order_id=order_id)
             else:
-                print("Insert may have failed but did not throw an exception")
+                log.error('order_not_stored', extra={'order_id': order_id})
                 return render_template('error.html', 
                                      error=f"Failed to place your order. Please try again or contact support.",
                                      details="Could not add your order to the database.")
                 
         except Exception as e:
-            print(f"Error inserting order: {str(e)}")
+            log.exception('order_insert_failed', extra={'order_id': order_id})
             return render_template('error.html', 
                                  error=f"Failed to place your order: {str(e)}",
                                  details="There was an error processing your request.")
             
     except Exception as e:
-        import traceback
-        print(f"Error placing order: {str(e)}")
-        print(traceback.format_exc())
+        log.exception('place_order_failed')
         return render_template('error.html', error=f"Order processing error: {str(e)}")
 
-@app.route('/admin')
+@store.route('/admin')
 def admin():
     try:
-        # Get all active orders and sort by order_id
-        response = supabase.table('order-list').select('*').order('order_id', desc=True).execute()
-        orders = response.data
+        search = request.args.get('q', '').strip()
+        before = request.args.get('before', type=int)
+        after = request.args.get('after', type=int)
+        sale = sale_calendar.current()
+        sale_id = sale['id'] if sale else None
         
-        item_summary = {}
-        total_amount_collected = 0
-        
-        food_items_response = supabase.table('food-items').select('*').execute()
-        food_items = food_items_response.data
-        
-        price_lookup = {}
-        for item in food_items:
-            price_lookup[item['name']] = item.get('price', 0)
+        # One keyset page of the current sale's orders, newest first. Fetch
+        # one extra row to know whether there is another page in that direction.
+        if after is not None:
+            fetch_page = lambda: repository.list_orders(after=after, limit=ADMIN_PAGE_SIZE + 1, search=search or None,
+                                                        sale_id=sale_id)
+        else:
+            fetch_page = lambda: repository.list_orders(desc=True, after=before, limit=ADMIN_PAGE_SIZE + 1,
+                                                        search=search or None, sale_id=sale_id)
         
-        # Process orders
-        for order in orders:
-            if isinstance(order, dict):
-                order_total = 0
-                
-                if 'item' in order and isinstance(order['item'], str) and '(x' in order['item']:
-                    items_string = order['item']
-                    items_parts = items_string.split(', ')
-                    
-                    for item_part in items_parts:
-                        if '(x' in item_part:
-                            item_name_parts = item_part.split(' (x')
-                            if len(item_name_parts) >= 2:
-                                item_name = item_name_parts[0]
-                                try:
-                                    quantity_str = item_name_parts[1].rstrip(')')
-                                    quantity = int(quantity_str)
-                                except (ValueError, IndexError):
-                                    quantity = 1
-                                
-                                # Update order total
-                                item_price = price_lookup.get(item_name, 0)
-                                order_total += item_price * quantity
-                                
-                                if item_name in item_summary:
-                                    item_summary[item_name] += quantity
-                                else:
-                                    item_summary[item_name] = quantity
-                
-                elif 'item' in order and not isinstance(order['item'], list):
-                    item_name = str(order['item'])
-                    try:
-                        quantity = int(order.get('quantity', 1))
-                    except (ValueError, TypeError):
-                        quantity = 1
-                    
-                    # Update order total
-                    item_price = price_lookup.get(item_name, 0)
-                    order_total += item_price * quantity
-                        
-                    # Update summary
-                    if item_name in item_summary:
-                        item_summary[item_name] += quantity
-                    else:
-                        item_summary[item_name] = quantity
-                
-                # Add total amount to the order
-                order['total_amount'] = round(order_total, 3)
-                total_amount_collected += order_total
+        # The page, the menu (legacy rows only carry item names, so prices
+        # are resolved by name) and the ordered totals don't depend on each other
+        orders, name_index, ordered_quantities = query_pool.gather(
+            fetch_page, menu_catalog.name_index, stock_ledger.snapshot)
         
-        sorted_summary = dict(sorted(item_summary.items()))
+        has_more = len(orders) > ADMIN_PAGE_SIZE
+        if after is not None:
+            orders = list(reversed(orders[:ADMIN_PAGE_SIZE]))
+            has_newer, has_older = has_more, True
+        else:
+            orders = orders[:ADMIN_PAGE_SIZE]
+            has_newer, has_older = before is not None, has_more
         
+        # Process the orders on this page
         parsed_orders = []
         for order in orders:
             if isinstance(order, dict):
                 parsed_order = dict(order)  # Make a copy
-                
-                if 'item' in parsed_order and isinstance(parsed_order['item'], str) and '(x' in parsed_order['item']:
-                    items_string = parsed_order['item']
-                    items_parts = items_string.split(', ')
-                    
-                    parsed_items = []
-                    for item_part in items_parts:
-                        if '(x' in item_part:
-                            name_parts = item_part.split(' (x')
-                            if len(name_parts) >= 2:
-                                name = name_parts[0]
-                                qty = name_parts[1].rstrip(')')
-                                parsed_items.append({'name': name, 'quantity': qty})
-                    
-                    parsed_order['parsed_items'] = parsed_items
-                
+                line_items = order_line_items(order, name_index)
+                parsed_order['line_items'] = line_items
+                parsed_order['total_amount'] = round(order_total(line_items), 3)
                 parsed_orders.append(parsed_order)
         
+        # Totals across every order come from the stock ledger rather than a
+        # pass over the whole table
+        item_summary = {name: quantity for name, quantity in ordered_quantities.items() if quantity > 0}
+        total_amount_collected = sum(
+            quantity * name_index.get(name, {}).get('price', 0) for name, quantity in item_summary.items()
+        )
+        sorted_summary = dict(sorted(item_summary.items()))
+        
+        pagination = {
+            'search': search,
+            'newer': parsed_orders[0]['order_id'] if has_newer and parsed_orders else None,
+            'older': parsed_orders[-1]['order_id'] if has_older and parsed_orders else None,
+        }
+        
         return render_template('admin.html', 
                               orders=parsed_orders, 
+                              pagination=pagination,
                               item_summary=sorted_summary,
                               total_amount=round(total_amount_collected, 3),
                               EXCEL_ENGINE=EXCEL_ENGINE,
-                              bookings_closed=BOOKINGS_CLOSED)
+                              bookings_closed=shared_state.get('bookings_closed'),
+                              sale=sale,
+                              sale_open=is_open(sale),
+                              sale_date=format_sale_date(sale),
+                              past_sales=[past for past in sale_calendar.all_sales() if past['id'] != sale_id],
+                              menu_cache=menu_catalog.stats(),
+                              order_queue=order_flusher.stats() if order_flusher is not None else None,
+                              clear_summary=request.args if 'cleared' in request.args else None)
     except Exception as e:
-        import traceback
-        print(f"Error in admin route: {e}")
+        log.exception('admin_failed')
         return render_template('error.html', error=f"Admin page error: {str(e)}")
 
-@app.route('/toggle_bookings', methods=['POST'])
+@store.route('/toggle_bookings', methods=['POST'])
 def toggle_bookings():
     try:
         submitted_password = request.form.get('password')
@@ -479,18 +868,40 @@ def toggle_bookings():
         if not submitted_password or submitted_password != correct_password:
             return render_template('error.html', error="Incorrect password. Booking status not changed.")
         
-        # If password is correct, proceed with toggling bookings status
-        global BOOKINGS_CLOSED
-        BOOKINGS_CLOSED = not BOOKINGS_CLOSED
-        status = "closed" if BOOKINGS_CLOSED else "open"
-        print(f"Bookings status changed to: {status}")
+        # If password is correct, proceed with toggling bookings status for every worker
+        closed = shared_state.set_bookings_closed(not shared_state.get('bookings_closed'))['bookings_closed']
+        status = "closed" if closed else "open"
+        log.info('bookings_toggled', extra={'status': status})
             
-        return redirect(url_for('admin'))
+        return redirect(url_for('store.admin'))
     except Exception as e:
-        print(f"Error toggling bookings status: {str(e)}")
+        log.exception('toggle_bookings_failed')
         return render_template('error.html', error=f"Could not change bookings status: {str(e)}")
 
-@app.route('/clear_orders', methods=['POST'])
+@store.route('/refresh_menu', methods=['POST'])
+def refresh_menu():
+    try:
+        submitted_password = request.form.get('password')
+        
+        correct_password = os.environ.get('DELETE_PASS')
+        
+        # Verify the password
+        if not submitted_password or submitted_password != correct_password:
+            return render_template('error.html', error="Incorrect password. Menu was not refreshed.")
+        
+        # Drop cached sales and menu items so the next request re-reads them,
+        # here and (through the shared epoch) in every other worker
+        sale_calendar.invalidate()
+        menu_catalog.invalidate()
+        shared_state.bump('menu_epoch')
+        log.info('menu_cache_invalidated', extra={'version': menu_catalog.version})
+        
+        return redirect(url_for('store.admin'))
+    except Exception as e:
+        log.exception('refresh_menu_failed')
+        return render_template('error.html', error=f"Could not refresh menu: {str(e)}")
+
+@store.route('/clear_orders', methods=['POST'])
 def clear_orders():
     try:
         submitted_password = request.form.get('password')
@@ -501,24 +912,42 @@ def clear_orders():
         if not submitted_password or submitted_password != correct_password:
             return render_template('error.html', error="Incorrect password. Orders were not cleared.")
         
-        # If password is correct, proceed with clearing orders
-        response = supabase.table('order-list').select('order_id').execute()
-        order_ids = [order['order_id'] for order in response.data if isinstance(order, dict) and 'order_id' in order]
+        # Journaled orders count as placed, so store them before clearing
+        if order_flusher is not None:
+            order_flusher.flush()
         
-        if order_ids:
-            print(f"Deleting orders with IDs: {order_ids}")
-            for order_id in order_ids:
-                delete_response = supabase.table('order-list').delete().eq('order_id', order_id).execute()
-                print(f"Deleted order {order_id}: {delete_response}")
-        else:
-            print("No orders found to delete")
-            
-        return redirect(url_for('admin'))
+        # If password is correct, proceed with clearing the current sale's
+        # orders. Only orders that exist right now are cleared, so one placed
+        # mid-clear survives.
+        sale_id = sale_calendar.current_id()
+        latest = repository.list_orders(columns='order_id', desc=True, limit=1, sale_id=sale_id)
+        if not latest:
+            log.info('orders_cleared', extra={'cleared': 0})
+            return redirect(url_for('store.admin', cleared=0))
+        through = latest[0]['order_id']
+        
+        started = time.perf_counter()
+        archived = None
+        if request.form.get('archive') == 'on':
+            archived = repository.archive_orders(through, batch_size=CLEAR_BATCH_SIZE, sale_id=sale_id)
+            log.info('orders_archived', extra={'archived': archived, 'through': through})
+        
+        cleared = repository.delete_orders_through(through, sale_id=sale_id)
+        log.info('orders_cleared', extra={'cleared': cleared, 'through': through})
+        
+        repository.recount()
+        stock_ledger.reconcile()
+        shared_state.bump('stock_epoch')
+        
+        summary = {'cleared': cleared, 'seconds': round(time.perf_counter() - started, 2)}
+        if archived is not None:
+            summary['archived'] = archived
+        return redirect(url_for('store.admin', **summary))
     except Exception as e:
-        print(f"Error clearing orders: {str(e)}")
+        log.exception('clear_orders_failed')
         return render_template('error.html', error=f"Could not clear orders: {str(e)}")
 
-@app.route('/delete_order', methods=['POST'])
+@store.route('/delete_order', methods=['POST'])
 def delete_order():
     try:
         order_id = request.form.get('order_id')
@@ -532,160 +961,78 @@ def delete_order():
         
         # If password is correct, proceed with deleting the order
         if order_id:
-            print(f"Deleting order with ID: {order_id}")
-            delete_response = supabase.table('order-list').delete().eq('order_id', order_id).execute()
-            print(f"Deleted order {order_id}: {delete_response}")
+            # The order may still be waiting in the journal
+            pending_order = order_journal.discard(order_id) if order_journal is not None else None
+            deleted_orders = repository.delete_order(order_id)
+            if pending_order and not deleted_orders:
+                deleted_orders = [pending_order]
+            log.info('order_deleted', extra={'order_id': order_id, 'rows': len(deleted_orders)})
+            
+            # Give the deleted rows' stock back to the ledger as well, and
+            # have the other workers re-read theirs
+            stock_ledger.release(count_ordered_items(deleted_orders))
+            shared_state.bump('stock_epoch')
             
-            return redirect(url_for('admin'))
+            return redirect(url_for('store.admin'))
         else:
             return render_template('error.html', error="No order ID provided.")
     except Exception as e:
-        print(f"Error deleting order: {str(e)}")
+        log.exception('delete_order_failed', extra={'order_id': request.form.get('order_id')})
         return render_template('error.html', error=f"Could not delete order: {str(e)}")
 
-@app.route('/export_excel')
+@store.route('/export_excel')
 def export_excel():
-    """Export all orders as Excel file"""
+    """Export the current sale's orders (or ?sale=<id>) as Excel file (or CSV with ?format=csv)"""
     try:
-        # Check if pandas and an Excel engine are available
-        if pd is None or EXCEL_ENGINE is None:
-            return render_template('error.html', 
-                              error="Excel export not available",
-                              details="Required libraries are not installed. Please run: pip install pandas xlsxwriter or pip install pandas openpyxl")
-        
-        response = supabase.table('order-list').select('*').execute()
-        orders = response.data
-        
-        food_items_response = supabase.table('food-items').select('*').execute()
-        food_items = food_items_response.data
-        
-        price_lookup = {}
-        for item in food_items:
-            price_lookup[item['name']] = item.get('price', 0)
+        today = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        sale_id = request.args.get('sale', type=int) or sale_calendar.current_id()
         
-        # Process orders
-        order_data = []
-        item_summary = {}
-        total_amount_collected = 0
+        # Orders are paged in by keyset and written as they arrive
+        orders = repository.iter_orders(page_size=EXPORT_PAGE_SIZE, sale_id=sale_id)
         
-        for order in orders:
-            if isinstance(order, dict):
-                order_total = 0
-                
-                if 'item' in order and isinstance(order['item'], str) and '(x' in order['item']:
-                    items_string = order['item']
-                    items_parts = items_string.split(', ')
-                    
-                    for item_part in items_parts:
-                        if '(x' in item_part:
-                            item_name_parts = item_part.split(' (x')
-                            if len(item_name_parts) >= 2:
-                                item_name = item_name_parts[0]
-                                try:
-                                    quantity_str = item_name_parts[1].rstrip(')')
-                                    quantity = int(quantity_str)
-                                except (ValueError, IndexError):
-                                    quantity = 1
-                                
-                                # Update order total and item summary
-                                item_price = price_lookup.get(item_name, 0)
-                                order_total += item_price * quantity
-                                
-                                if item_name in item_summary:
-                                    item_summary[item_name] += quantity
-                                else:
-                                    item_summary[item_name] = quantity
-                
-                elif 'item' in order and not isinstance(order['item'], list):
-                    item_name = str(order['item'])
-                    try:
-                        quantity = int(order.get('quantity', 1))
-                    except (ValueError, TypeError):
-                        quantity = 1
-                    
-                    # Update order total and item summary
-                    item_price = price_lookup.get(item_name, 0)
-                    order_total += item_price * quantity
-                        
-                    # Update summary
-                    if item_name in item_summary:
-                        item_summary[item_name] += quantity
-                    else:
-                        item_summary[item_name] = quantity
-                
-                # Add total amount to the order
-                order['total_amount'] = round(order_total, 3)
-                total_amount_collected += order_total
-                
-                # Format the order data for Excel
-                order_dict = {
-                    'Order ID': order.get('order_id', ''),
-                    'Customer Name': order.get('customer_name', ''),
-                    'Phone': order.get('phone', ''),
-                    'Items': order.get('item', ''),
-                    'Quantity': order.get('quantity', ''),
-                    'Membership': order.get('membership', ''),
-                    'Total Amount (KD)': order.get('total_amount', 0)
-                }
-                order_data.append(order_dict)
-        
-        # Create summary data
-        summary_data = [{"Item": item, "Quantity Ordered": qty} for item, qty in item_summary.items()]
-        summary_data.append({"Item": "TOTAL", "Quantity Ordered": sum(item_summary.values())})
-        
-        # Create Excel file with multiple sheets
-        today = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        output = BytesIO()
+        # Legacy rows only carry item names, so resolve prices by name
+        if sale_id == sale_calendar.current_id():
+            load_name_index = menu_catalog.name_index
+        else:
+            load_name_index = lambda: {item['name']: item for item in repository.list_food_items(sale_id=sale_id)}
         
-        # Create DataFrame for orders
-        df_orders = pd.DataFrame(order_data) if order_data else pd.DataFrame({'No Data': ['No orders found']})
+        # Fetch the first page of orders while the menu loads
+        first_order, name_index = query_pool.gather(lambda: next(orders, None), load_name_index)
+        if first_order is not None:
+            orders = itertools.chain([first_order], orders)
         
-        # Create DataFrame for summary
-        df_summary = pd.DataFrame(summary_data) if summary_data else pd.DataFrame({'No Data': ['No items ordered']})
+        filename = f'orders_export_sale{sale_id}_{today}' if sale_id is not None else f'orders_export_{today}'
+        if request.args.get('format') == 'csv':
+            return Response(
+                stream_with_context(iter_csv(orders, name_index)),
+                mimetype='text/csv',
+                headers={'Content-Disposition': f'attachment; filename={filename}.csv'}
+            )
         
-        # Create Excel writer with the available engine
-        with pd.ExcelWriter(output, engine=EXCEL_ENGINE) as writer:
-            df_orders.to_excel(writer, sheet_name='Orders', index=False)
-            df_summary.to_excel(writer, sheet_name='Summary', index=False)
-            
-            # Only apply formatting if xlsxwriter is the engine
-            if EXCEL_ENGINE == 'xlsxwriter':
-                try:
-                    # Format the Orders sheet
-                    workbook = writer.book
-                    worksheet = writer.sheets['Orders']
-                    header_format = workbook.add_format({'bold': True, 'bg_color': '#333333', 'font_color': 'white'})
-                    
-                    for col_num, value in enumerate(df_orders.columns.values):
-                        worksheet.write(0, col_num, value, header_format)
-                    
-                    # Format the Summary sheet
-                    worksheet = writer.sheets['Summary']
-                    total_format = workbook.add_format({'bold': True, 'bg_color': '#DDDDDD'})
-                    
-                    for col_num, value in enumerate(df_summary.columns.values):
-                        worksheet.write(0, col_num, value, header_format)
-                    
-                    # Format total row
-                    if len(summary_data) > 0:
-                        last_row = len(summary_data)
-                        worksheet.set_row(last_row, None, total_format)
-                except Exception as format_error:
-                    print(f"Warning: Could not apply Excel formatting: {str(format_error)}")
+        # Check if an Excel engine is available
+        if EXCEL_ENGINE is None:
+            return render_template('error.html', 
+                              error="Excel export not available",
+                              details="Required libraries are not installed. Please run: pip install xlsxwriter")
         
-        output.seek(0)
+        # constant_memory mode needs a real file; it is unlinked once opened
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            write_xlsx(path, orders, name_index)
+            output = open(path, 'rb')
+        finally:
+            os.remove(path)
         
         return send_file(
             output,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            download_name=f'orders_export_{today}.xlsx',
+            download_name=f'{filename}.xlsx',
             as_attachment=True
         )
         
     except Exception as e:
-        import traceback
-        print(f"Error exporting Excel: {str(e)}")
-        print(traceback.format_exc())
+        log.exception('export_failed')
         
         # If the error is specifically about missing xlsxwriter, give a helpful message
         if "No module named 'xlsxwriter'" in str(e):
@@ -697,26 +1044,64 @@ def export_excel():
                               error=f"Failed to export data: {str(e)}",
                               details="There was an error processing your request.")
 
-@app.route('/bookings_closed')
+@store.route('/bookings_closed')
 def bookings_closed():
     return render_template('bookings_closed.html')
 
-@app.template_filter('datetime')
+@store.app_template_filter('datetime')
 def format_datetime(timestamp):
     from datetime import datetime, timedelta
     try:
+        # Order IDs carry their creation time; plain Unix timestamps pass through
         # Convert timestamp to datetime in UTC and add 3 hours for Arabian Standard Time (UTC+3)
-        dt_utc = datetime.utcfromtimestamp(timestamp)
+        dt_utc = datetime.utcfromtimestamp(order_id_timestamp(timestamp))
         dt_ast = dt_utc + timedelta(hours=3)
         return dt_ast.strftime('%Y-%m-%d %H:%M:%S')
     
     except (ValueError, TypeError):
         return 'Invalid timestamp'
 
+@store.app_template_filter('sale_time')
+def format_sale_time(value):
+    # Sale windows are stored in UTC; show them in Arabian Standard Time (UTC+3)
+    from datetime import timedelta
+    return (value + timedelta(hours=3)).strftime('%Y-%m-%d %H:%M')
+
 # Add a custom template filter to convert Python boolean to string for JavaScript
-@app.template_filter('to_js_bool')
+@store.app_template_filter('to_js_bool')
 def to_js_bool(value):
     return str(bool(value))
 
+def create_app():
+    """Build the Flask app around the module-level services.
+
+    Nothing here (or at import time) opens a database connection: backend
+    clients and connections are created per process on first use. That
+    makes the module safe to import once in the gunicorn master with
+    ``preload_app`` (see ``gunicorn.conf.py``), so workers share the
+    imported code and compiled templates copy-on-write and only build
+    their own clients after the fork.
+    """
+    app = Flask(__name__, static_folder=None)
+    # A shared key keeps sessions valid across workers and restarts
+    app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
+    app.register_blueprint(store)
+    
+    # Static files are hashed and compressed once, and linked with ?v=<hash>
+    # so browsers can cache them for good
+    static_assets = StaticAssets(os.path.join(app.root_path, 'static'))
+    app.add_url_rule('/static/<path:filename>', endpoint='static', view_func=static_assets.serve)
+    app.url_defaults(static_assets.add_fingerprint)
+    
+    # Compile templates now rather than on each worker's first request
+    for template in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template)
+    
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':        
+    if BOOKINGS_CLOSED is not None:
+        shared_state.set_bookings_closed(BOOKINGS_CLOSED)
     app.run(debug=False)
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""Request and backend timings in the Prometheus text format.
+
+A few lock-protected dicts rather than a dependency on ``prometheus_client``:
+recording a sample is one dict lookup and a bisect, cheap enough to leave on
+for every request. Each gunicorn worker keeps its own numbers, so every
+series carries a ``pid`` label and dashboards should ``sum without (pid)``.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self, extra_labels=()):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(tuple(extra_labels) + labels)} {value}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield '_total', tuple(zip(self.labelnames, key)), value
+
+
+class Gauge(_Metric):
+    """A value read from ``callback`` at scrape time.
+
+    The callback returns a number, or ``{label_values_tuple: number}`` for a
+    labelled gauge. Returning None leaves the gauge out of the scrape.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def samples(self):
+        value = self._callback()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for key, sample in sorted(value.items()):
+            yield '', tuple(zip(self.labelnames, key)), sample
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self._buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (the last slot is +Inf), then sum
+                entry = self._values[key] = [[0] * (len(self._buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield '_bucket', labels + (('le', le),), cumulative
+            yield '_sum', labels, round(total, 6)
+            yield '_count', labels, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self._register(Gauge(name, documentation, callback, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        extra_labels = (('pid', os.getpid()),)
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render(extra_labels))
+            except Exception:
+                log.exception('metric_collect_failed', extra={'metric': metric.name})
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+def instrument(target, operations, histogram):
+    """Time ``target``'s methods into ``histogram``.
+
+    ``operations`` maps method names to ``(table, operation)`` labels. The
+    timed wrappers are set on the instance, so calls the object makes to
+    its own methods (``iter_orders`` paging through ``list_orders``) are
+    timed as well.
+    """
+    for method_name, (table, operation) in operations.items():
+        method = getattr(target, method_name, None)
+        if method is None:
+            continue
+        setattr(target, method_name, _timed(method, histogram, table, operation))
+    return target
+
+
+def _timed(method, histogram, table, operation):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = method(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            histogram.observe(time.perf_counter() - started, table=table, operation=operation, outcome=outcome)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
@@ -0,0 +1,60 @@
+"""One-time backfill of ``order-list.line_items`` from the legacy ``item`` text.
+
+Apply ``migrations/001_order_line_items.sql`` first, then run::
+
+    python migrate_line_items.py [--dry-run] [--batch-size 500]
+
+Rows that already have ``line_items`` are left alone, so the script can be
+re-run safely if it is interrupted.
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+from order_items import decode_legacy_items
+
+
+def migrate(supabase, batch_size=500, dry_run=False):
+    food_items = supabase.table('food-items').select('*').execute().data
+    name_index = {item['name']: item for item in food_items}
+
+    converted = 0
+    unresolved = set()
+    last_order_id = None
+
+    while True:
+        query = supabase.table('order-list').select('*').is_('line_items', 'null').order('order_id').limit(batch_size)
+        if last_order_id is not None:
+            query = query.gt('order_id', last_order_id)
+        rows = query.execute().data
+        if not rows:
+            break
+
+        for order in rows:
+            line_items = decode_legacy_items(order, name_index)
+            unresolved.update(line['name'] for line in line_items if line['item_id'] is None)
+
+            if not dry_run:
+                supabase.table('order-list').update({'line_items': line_items}).eq('order_id', order['order_id']).execute()
+            converted += 1
+
+        last_order_id = rows[-1]['order_id']
+        print(f"Converted {converted} orders (last order_id {last_order_id})")
+
+    if unresolved:
+        print(f"Item names not found in food-items: {', '.join(sorted(unresolved))}")
+    return converted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true', help="decode rows without writing them back")
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = create_client(os.environ.get('SUPA_URL'), os.environ.get('SUPA_KEY'))
+    total = migrate(client, batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"Done: {total} orders {'would be ' if args.dry_run else ''}converted")
@@ -0,0 +1,11 @@
+-- Structured line items for orders.
+-- Run once in the Supabase SQL editor, then backfill existing rows with
+-- `python migrate_line_items.py`.
+
+alter table "order-list"
+    add column if not exists line_items jsonb;
+
+-- Lets the backfill find unconverted rows without a full scan
+create index if not exists order_list_line_items_null_idx
+    on "order-list" (order_id)
+    where line_items is null;
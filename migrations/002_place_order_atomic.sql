@@ -0,0 +1,124 @@
+-- Atomic, oversell-proof order placement.
+-- Requires 001_order_line_items.sql and its backfill. Run once in the
+-- Supabase SQL editor; the app calls these functions through rpc().
+
+-- Units of each item held by placed orders, kept in step by the functions below
+alter table "food-items"
+    add column if not exists reserved integer not null default 0;
+
+-- Recompute every counter from the orders currently in the table.
+-- Also used after bulk deletes and to repair drift.
+create or replace function recount_reserved_stock()
+returns void
+language sql
+as $$
+    update "food-items" f
+    set reserved = coalesce((
+        select sum((line->>'quantity')::integer)
+        from "order-list" o, jsonb_array_elements(o.line_items) line
+        where (line->>'item_id')::bigint = f.id
+    ), 0);
+$$;
+
+select recount_reserved_stock();
+
+-- Check every line item of p_order against the stock left and insert the
+-- order, all in one transaction. Returns {"success": true, "order": {...}}
+-- or {"success": false, "shortfalls": [{item_id, name, requested, available}]}
+-- without reserving anything.
+create or replace function place_order_atomic(p_order jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_line record;
+    v_shortfalls jsonb := '[]'::jsonb;
+    v_order "order-list";
+begin
+    create temporary table if not exists pg_temp.requested_stock (
+        item_id bigint primary key,
+        name text,
+        requested integer
+    ) on commit drop;
+    truncate pg_temp.requested_stock;
+
+    insert into pg_temp.requested_stock (item_id, name, requested)
+    select (line->>'item_id')::bigint, min(line->>'name'), sum((line->>'quantity')::integer)
+    from jsonb_array_elements(p_order->'line_items') line
+    group by 1;
+
+    -- Lock the rows in id order so concurrent orders can't deadlock, then
+    -- compare what is left with what was asked for
+    for v_line in
+        select r.item_id, coalesce(f.name, r.name) as name, r.requested,
+               coalesce(f.quantity - f.reserved, 0) as available
+        from pg_temp.requested_stock r
+        left join lateral (
+            select id, name, quantity, reserved
+            from "food-items"
+            where id = r.item_id
+            for update
+        ) f on true
+        order by r.item_id
+    loop
+        if v_line.requested > v_line.available then
+            v_shortfalls := v_shortfalls || jsonb_build_object(
+                'item_id', v_line.item_id,
+                'name', v_line.name,
+                'requested', v_line.requested,
+                'available', greatest(v_line.available, 0)
+            );
+        end if;
+    end loop;
+
+    if jsonb_array_length(v_shortfalls) > 0 then
+        return jsonb_build_object('success', false, 'shortfalls', v_shortfalls);
+    end if;
+
+    update "food-items" f
+    set reserved = f.reserved + r.requested
+    from pg_temp.requested_stock r
+    where f.id = r.item_id;
+
+    insert into "order-list" (order_id, customer_name, phone, membership, item, quantity, line_items)
+    values (
+        (p_order->>'order_id')::bigint,
+        p_order->>'customer_name',
+        (p_order->>'phone')::bigint,
+        (p_order->>'membership')::bigint,
+        p_order->>'item',
+        (p_order->>'quantity')::integer,
+        p_order->'line_items'
+    )
+    returning * into v_order;
+
+    return jsonb_build_object('success', true, 'order', to_jsonb(v_order));
+end;
+$$;
+
+-- Delete one order and give its stock back. Returns the deleted rows.
+create or replace function delete_order_atomic(p_order_id bigint)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_deleted jsonb;
+begin
+    with deleted as (
+        delete from "order-list" where order_id = p_order_id returning *
+    ), released as (
+        update "food-items" f
+        set reserved = greatest(f.reserved - l.quantity, 0)
+        from (
+            select (line->>'item_id')::bigint as item_id, sum((line->>'quantity')::integer) as quantity
+            from deleted, jsonb_array_elements(deleted.line_items) line
+            group by 1
+        ) l
+        where f.id = l.item_id
+        returning f.id
+    )
+    select coalesce(jsonb_agg(to_jsonb(deleted)), '[]'::jsonb) into v_deleted from deleted;
+
+    return v_deleted;
+end;
+$$;
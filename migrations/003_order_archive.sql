@@ -0,0 +1,10 @@
+-- Archive table for orders from finished sales.
+-- clear_orders copies orders here in batches when run in archive mode.
+
+create table if not exists "order-archive" (
+    like "order-list" including defaults,
+    archived_at timestamptz not null default now()
+);
+
+create unique index if not exists order_archive_order_id_idx
+    on "order-archive" (order_id);
@@ -0,0 +1,178 @@
+-- Sale events with their own opening window and stock.
+-- Requires 002_place_order_atomic.sql and 003_order_archive.sql. Run once
+-- in the Supabase SQL editor. Existing orders and the current menu stock
+-- are moved into a first sale, dated 31 May 2025.
+--
+-- To run another sale later, insert a row into "sales" and one row per
+-- item on offer into "sale-items". It becomes the current sale once
+-- opens_at passes. Orders from earlier sales stay where they are.
+
+create table if not exists sales (
+    id bigint generated by default as identity primary key,
+    name text not null,
+    sale_date date,
+    opens_at timestamptz,
+    closes_at timestamptz,
+    created_at timestamptz not null default now()
+);
+
+-- Stock offered in each sale; reserved is kept in step by the functions below
+create table if not exists "sale-items" (
+    sale_id bigint not null references sales (id) on delete cascade,
+    item_id bigint not null references "food-items" (id) on delete cascade,
+    quantity integer not null default 0,
+    reserved integer not null default 0,
+    primary key (sale_id, item_id)
+);
+
+-- The menu of a sale: food-items rows with that sale's stock
+create or replace view "sale-menu" as
+    select f.id, f.name, f.price, f.image, f."Description", s.sale_id, s.quantity, s.reserved
+    from "food-items" f
+    join "sale-items" s on s.item_id = f.id;
+
+alter table "order-list"
+    add column if not exists sale_id bigint references sales (id);
+
+alter table "order-archive"
+    add column if not exists sale_id bigint;
+
+-- Every stock scan, admin page and export reads one sale's orders in id order
+create index if not exists order_list_sale_id_idx
+    on "order-list" (sale_id, order_id);
+
+-- Carry everything so far over into a first sale
+do $$
+declare
+    v_sale_id bigint;
+begin
+    if not exists (select 1 from sales) then
+        insert into sales (name, sale_date, opens_at)
+        values ('Food Sale', date '2025-05-31', now())
+        returning id into v_sale_id;
+
+        insert into "sale-items" (sale_id, item_id, quantity, reserved)
+        select v_sale_id, id, quantity, reserved from "food-items";
+
+        update "order-list" set sale_id = v_sale_id where sale_id is null;
+        update "order-archive" set sale_id = v_sale_id where sale_id is null;
+    end if;
+end;
+$$;
+
+-- Recompute every sale's counters from the orders currently in the table
+create or replace function recount_reserved_stock()
+returns void
+language sql
+as $$
+    update "sale-items" s
+    set reserved = coalesce((
+        select sum((line->>'quantity')::integer)
+        from "order-list" o, jsonb_array_elements(o.line_items) line
+        where o.sale_id = s.sale_id and (line->>'item_id')::bigint = s.item_id
+    ), 0);
+$$;
+
+-- As in 002, but checked against and reserved from the stock of the
+-- order's sale (p_order->>'sale_id')
+create or replace function place_order_atomic(p_order jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_sale_id bigint := (p_order->>'sale_id')::bigint;
+    v_line record;
+    v_shortfalls jsonb := '[]'::jsonb;
+    v_order "order-list";
+begin
+    create temporary table if not exists pg_temp.requested_stock (
+        item_id bigint primary key,
+        name text,
+        requested integer
+    ) on commit drop;
+    truncate pg_temp.requested_stock;
+
+    insert into pg_temp.requested_stock (item_id, name, requested)
+    select (line->>'item_id')::bigint, min(line->>'name'), sum((line->>'quantity')::integer)
+    from jsonb_array_elements(p_order->'line_items') line
+    group by 1;
+
+    -- Lock the rows in id order so concurrent orders can't deadlock, then
+    -- compare what is left with what was asked for
+    for v_line in
+        select r.item_id, r.name, r.requested,
+               coalesce(s.quantity - s.reserved, 0) as available
+        from pg_temp.requested_stock r
+        left join lateral (
+            select quantity, reserved
+            from "sale-items"
+            where sale_id = v_sale_id and item_id = r.item_id
+            for update
+        ) s on true
+        order by r.item_id
+    loop
+        if v_line.requested > v_line.available then
+            v_shortfalls := v_shortfalls || jsonb_build_object(
+                'item_id', v_line.item_id,
+                'name', v_line.name,
+                'requested', v_line.requested,
+                'available', greatest(v_line.available, 0)
+            );
+        end if;
+    end loop;
+
+    if jsonb_array_length(v_shortfalls) > 0 then
+        return jsonb_build_object('success', false, 'shortfalls', v_shortfalls);
+    end if;
+
+    update "sale-items" s
+    set reserved = s.reserved + r.requested
+    from pg_temp.requested_stock r
+    where s.sale_id = v_sale_id and s.item_id = r.item_id;
+
+    insert into "order-list" (order_id, customer_name, phone, membership, item, quantity, line_items, sale_id)
+    values (
+        (p_order->>'order_id')::bigint,
+        p_order->>'customer_name',
+        (p_order->>'phone')::bigint,
+        (p_order->>'membership')::bigint,
+        p_order->>'item',
+        (p_order->>'quantity')::integer,
+        p_order->'line_items',
+        v_sale_id
+    )
+    returning * into v_order;
+
+    return jsonb_build_object('success', true, 'order', to_jsonb(v_order));
+end;
+$$;
+
+-- Delete one order and give its stock back to its sale. Returns the deleted rows.
+create or replace function delete_order_atomic(p_order_id bigint)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_deleted jsonb;
+begin
+    with deleted as (
+        delete from "order-list" where order_id = p_order_id returning *
+    ), released as (
+        update "sale-items" s
+        set reserved = greatest(s.reserved - l.quantity, 0)
+        from (
+            select deleted.sale_id, (line->>'item_id')::bigint as item_id,
+                   sum((line->>'quantity')::integer) as quantity
+            from deleted, jsonb_array_elements(deleted.line_items) line
+            group by 1, 2
+        ) l
+        where s.sale_id = l.sale_id and s.item_id = l.item_id
+        returning s.item_id
+    )
+    select coalesce(jsonb_agg(to_jsonb(deleted)), '[]'::jsonb) into v_deleted from deleted;
+
+    return v_deleted;
+end;
+$$;
+
+select recount_reserved_stock();
@@ -0,0 +1,24 @@
+-- Order ids are 64-bit snowflakes (see order_ids.py), around 3.7e17.
+-- Tables created when ids were Unix seconds may have an integer order_id,
+-- which can't hold them. Run once in the Supabase SQL editor; it does
+-- nothing where the columns are already bigint.
+
+do $$
+begin
+    if exists (
+        select 1 from information_schema.columns
+        where table_schema = 'public' and table_name = 'order-list'
+          and column_name = 'order_id' and data_type <> 'bigint'
+    ) then
+        alter table "order-list" alter column order_id type bigint;
+    end if;
+
+    if exists (
+        select 1 from information_schema.columns
+        where table_schema = 'public' and table_name = 'order-archive'
+          and column_name = 'order_id' and data_type <> 'bigint'
+    ) then
+        alter table "order-archive" alter column order_id type bigint;
+    end if;
+end;
+$$;
@@ -0,0 +1,67 @@
+-- Batch inserts for the write-behind order journal.
+-- Requires 004_sales.sql. Run once in the Supabase SQL editor.
+--
+-- Orders confirmed from the journal were already checked against the
+-- stock ledger, so they skip the check in place_order_atomic. Each flush
+-- used to insert them and then run recount_reserved_stock(), which rescans
+-- every order kept in order-list. record_orders adds just the batch's own
+-- line items to reserved instead.
+
+-- Insert the orders in p_orders (a json array of order-list rows) and
+-- reserve their stock in their sale. Order ids already in the table are
+-- skipped, and so is their stock, so a retried batch is never counted
+-- twice. Returns the number of orders inserted.
+create or replace function record_orders(p_orders jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+    v_inserted jsonb;
+begin
+    with inserted as (
+        insert into "order-list" (order_id, customer_name, phone, membership, item, quantity, line_items, sale_id)
+        select (o->>'order_id')::bigint,
+               o->>'customer_name',
+               (o->>'phone')::bigint,
+               (o->>'membership')::bigint,
+               o->>'item',
+               (o->>'quantity')::integer,
+               o->'line_items',
+               (o->>'sale_id')::bigint
+        from jsonb_array_elements(p_orders) o
+        on conflict (order_id) do nothing
+        returning sale_id, line_items
+    )
+    select coalesce(jsonb_agg(jsonb_build_object('sale_id', sale_id, 'line_items', line_items)), '[]'::jsonb)
+    into v_inserted
+    from inserted;
+
+    create temporary table if not exists pg_temp.recorded_stock (
+        sale_id bigint,
+        item_id bigint,
+        quantity integer,
+        primary key (sale_id, item_id)
+    ) on commit drop;
+    truncate pg_temp.recorded_stock;
+
+    insert into pg_temp.recorded_stock (sale_id, item_id, quantity)
+    select (o->>'sale_id')::bigint, (line->>'item_id')::bigint, sum((line->>'quantity')::integer)
+    from jsonb_array_elements(v_inserted) o, jsonb_array_elements(o->'line_items') line
+    group by 1, 2;
+
+    -- Lock the rows in id order, as place_order_atomic does, so the two
+    -- can't deadlock
+    perform 1
+    from "sale-items" s
+    join pg_temp.recorded_stock r on r.sale_id = s.sale_id and r.item_id = s.item_id
+    order by s.sale_id, s.item_id
+    for update of s;
+
+    update "sale-items" s
+    set reserved = s.reserved + r.quantity
+    from pg_temp.recorded_stock r
+    where s.sale_id = r.sale_id and s.item_id = r.item_id;
+
+    return jsonb_array_length(v_inserted);
+end;
+$$;
@@ -0,0 +1,89 @@
+-- Refuse line items for less than one unit.
+-- Requires 004_sales.sql. Run once in the Supabase SQL editor.
+--
+-- place_order_atomic only compared what each item was asked for with what
+-- is left, so a line with a quantity of -5 passed the check and lowered
+-- reserved by 5, letting later orders sell those units again.
+
+-- As in 004, but raising before anything is reserved when a line item's
+-- quantity is missing or below 1
+create or replace function place_order_atomic(p_order jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_sale_id bigint := (p_order->>'sale_id')::bigint;
+    v_line record;
+    v_shortfalls jsonb := '[]'::jsonb;
+    v_order "order-list";
+begin
+    -- A line for less than one unit would take units back off reserved
+    if exists (
+        select 1 from jsonb_array_elements(p_order->'line_items') line
+        where coalesce((line->>'quantity')::integer, 0) < 1
+    ) then
+        raise exception 'Every line item needs a quantity of at least 1'
+            using errcode = 'check_violation';
+    end if;
+
+    create temporary table if not exists pg_temp.requested_stock (
+        item_id bigint primary key,
+        name text,
+        requested integer
+    ) on commit drop;
+    truncate pg_temp.requested_stock;
+
+    insert into pg_temp.requested_stock (item_id, name, requested)
+    select (line->>'item_id')::bigint, min(line->>'name'), sum((line->>'quantity')::integer)
+    from jsonb_array_elements(p_order->'line_items') line
+    group by 1;
+
+    -- Lock the rows in id order so concurrent orders can't deadlock, then
+    -- compare what is left with what was asked for
+    for v_line in
+        select r.item_id, r.name, r.requested,
+               coalesce(s.quantity - s.reserved, 0) as available
+        from pg_temp.requested_stock r
+        left join lateral (
+            select quantity, reserved
+            from "sale-items"
+            where sale_id = v_sale_id and item_id = r.item_id
+            for update
+        ) s on true
+        order by r.item_id
+    loop
+        if v_line.requested > v_line.available then
+            v_shortfalls := v_shortfalls || jsonb_build_object(
+                'item_id', v_line.item_id,
+                'name', v_line.name,
+                'requested', v_line.requested,
+                'available', greatest(v_line.available, 0)
+            );
+        end if;
+    end loop;
+
+    if jsonb_array_length(v_shortfalls) > 0 then
+        return jsonb_build_object('success', false, 'shortfalls', v_shortfalls);
+    end if;
+
+    update "sale-items" s
+    set reserved = s.reserved + r.requested
+    from pg_temp.requested_stock r
+    where s.sale_id = v_sale_id and s.item_id = r.item_id;
+
+    insert into "order-list" (order_id, customer_name, phone, membership, item, quantity, line_items, sale_id)
+    values (
+        (p_order->>'order_id')::bigint,
+        p_order->>'customer_name',
+        (p_order->>'phone')::bigint,
+        (p_order->>'membership')::bigint,
+        p_order->>'item',
+        (p_order->>'quantity')::integer,
+        p_order->'line_items',
+        v_sale_id
+    )
+    returning * into v_order;
+
+    return jsonb_build_object('success', true, 'order', to_jsonb(v_order));
+end;
+$$;
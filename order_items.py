@@ -0,0 +1,98 @@
+"""Structured order line items.
+
+Orders carry a ``line_items`` JSONB column holding one entry per cart line::
+
+    [{"item_id": 3, "name": "Samosa", "quantity": 2, "unit_price": 0.5}, ...]
+
+Rows written before the column existed only have the ``item`` text column
+(``"Samosa (x2), Tea (x1)"``). :func:`decode_legacy_items` is the one place
+that still understands that format; everything else goes through
+:func:`order_line_items`.
+"""
+
+
+def _to_item_id(item_id):
+    if isinstance(item_id, str) and item_id.isdigit():
+        return int(item_id)
+    return item_id
+
+
+def build_line_items(cart):
+    """Turn a resolved cart (``{item_id: {name, price, quantity}}``) into line items."""
+    line_items = []
+    for item_id, item_data in cart.items():
+        line_items.append({
+            'item_id': _to_item_id(item_id),
+            'name': item_data['name'],
+            'quantity': int(item_data['quantity']),
+            'unit_price': item_data.get('price', 0),
+        })
+    return line_items
+
+
+def format_items_text(line_items):
+    """Render line items in the human readable ``item`` column format."""
+    return ", ".join(f"{line['name']} (x{line['quantity']})" for line in line_items)
+
+
+def decode_legacy_items(order, name_index=None):
+    """Decode the ``item`` text column of a pre-migration order.
+
+    ``name_index`` maps item names to ``food-items`` rows and is used to fill
+    in ``item_id`` and ``unit_price``, which the text format does not carry.
+    """
+    name_index = name_index or {}
+    item_text = order.get('item')
+    parsed = []
+
+    if isinstance(item_text, str) and '(x' in item_text:
+        for item_part in item_text.split(', '):
+            if '(x' in item_part:
+                item_name_parts = item_part.split(' (x')
+                if len(item_name_parts) >= 2:
+                    try:
+                        quantity = int(item_name_parts[1].rstrip(')'))
+                    except (ValueError, IndexError):
+                        quantity = 1
+                    parsed.append((item_name_parts[0], quantity))
+
+    elif item_text is not None and not isinstance(item_text, list):
+        try:
+            quantity = int(order.get('quantity', 1))
+        except (ValueError, TypeError):
+            quantity = 1
+        parsed.append((str(item_text), quantity))
+
+    line_items = []
+    for name, quantity in parsed:
+        food_item = name_index.get(name) or {}
+        line_items.append({
+            'item_id': food_item.get('id'),
+            'name': name,
+            'quantity': quantity,
+            'unit_price': food_item.get('price', 0),
+        })
+    return line_items
+
+
+def order_line_items(order, name_index=None):
+    """Line items of an order row, decoding legacy rows on the fly."""
+    if not isinstance(order, dict):
+        return []
+    line_items = order.get('line_items')
+    if isinstance(line_items, list):
+        return line_items
+    return decode_legacy_items(order, name_index)
+
+
+def order_total(line_items):
+    return sum(line['quantity'] * (line.get('unit_price') or 0) for line in line_items)
+
+
+def count_ordered_items(orders):
+    """Sum the ordered quantity of every item name across ``orders``."""
+    ordered_quantities = {}
+    for order in orders:
+        for line in order_line_items(order):
+            ordered_quantities[line['name']] = ordered_quantities.get(line['name'], 0) + line['quantity']
+    return ordered_quantities
@@ -0,0 +1,213 @@
+"""Write-behind ingestion of new orders.
+
+With ``ORDER_WRITE_BEHIND`` switched on, ``place_order`` no longer waits for
+Supabase. The order is checked against the stock ledger, appended to a local
+journal and confirmed straight away; an :class:`OrderFlusher` thread then
+batch-inserts journaled orders into ``order-list`` and reserves their
+stock (``record_orders``), retrying with backoff while Supabase is slow or down.
+
+The journal is a SQLite database in WAL mode with ``synchronous=full``, so a
+confirmed order survives a crash or restart and is replayed by the next
+flusher. Processes can share one journal file (a restarted worker overlaps
+the one it replaces): rows are leased to a flusher while it inserts them,
+and the inserts ignore order ids that already exist, so a batch that is
+retried after a partial failure is never duplicated.
+
+Stock is checked against the worker's own ledger until the order is
+flushed, which only holds every confirmed order with a single worker; two
+workers could both sell the same last units. ``gunicorn.conf.py`` refuses
+to start the mode with more than one.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from sqlite_connections import ThreadLocalConnections
+
+log = logging.getLogger(__name__)
+
+JOURNAL_SCHEMA = """
+create table if not exists "order-journal" (
+    order_id integer primary key,
+    payload text not null,
+    created_at real not null,
+    attempts integer not null default 0,
+    last_error text,
+    leased_by text,
+    leased_until real
+);
+"""
+
+
+class OrderJournal:
+    """Durable queue of orders that have been confirmed but not yet stored."""
+
+    def __init__(self, path='order_journal.db', timeout=30):
+        # A confirmed order has to be on disk before the customer sees it
+        self._connections = ThreadLocalConnections(path, timeout=timeout, synchronous='full')
+        self._connection().executescript(JOURNAL_SCHEMA)
+
+    def append(self, order_data):
+        conn = self._connection()
+        conn.execute(
+            'insert into "order-journal" (order_id, payload, created_at) values (?, ?, ?)',
+            (order_data['order_id'], json.dumps(order_data), time.time()),
+        )
+
+    def lease(self, owner, limit=100, lease_seconds=60):
+        """Claim up to ``limit`` unclaimed (or expired) orders for ``owner``, oldest first."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute('begin immediate')
+        try:
+            rows = conn.execute(
+                'select order_id, payload from "order-journal" '
+                'where leased_until is null or leased_until < ? order by order_id limit ?',
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                'update "order-journal" set leased_by = ?, leased_until = ? where order_id = ?',
+                [(owner, now + lease_seconds, row[0]) for row in rows],
+            )
+        except BaseException:
+            conn.execute('rollback')
+            raise
+        conn.execute('commit')
+        return [json.loads(row[1]) for row in rows]
+
+    def complete(self, order_ids):
+        """Drop orders that are now safely in ``order-list``."""
+        self._connection().executemany(
+            'delete from "order-journal" where order_id = ?', [(order_id,) for order_id in order_ids])
+
+    def release(self, order_ids, error):
+        """Hand leased orders back after a failed flush so they are retried."""
+        self._connection().executemany(
+            'update "order-journal" set attempts = attempts + 1, last_error = ?, '
+            'leased_by = null, leased_until = null where order_id = ?',
+            [(error, order_id) for order_id in order_ids],
+        )
+
+    def discard(self, order_id):
+        """Remove an order before it was flushed; returns it, or None."""
+        conn = self._connection()
+        row = conn.execute('select payload from "order-journal" where order_id = ?', (int(order_id),)).fetchone()
+        conn.execute('delete from "order-journal" where order_id = ?', (int(order_id),))
+        return json.loads(row[0]) if row else None
+
+    def pending_orders(self):
+        return [json.loads(row[0]) for row in self._connection().execute(
+            'select payload from "order-journal" order by order_id')]
+
+    def stats(self):
+        depth, oldest, retried, last_error = self._connection().execute(
+            'select count(*), min(created_at), sum(attempts > 0), '
+            '(select last_error from "order-journal" where last_error is not null order by order_id desc limit 1) '
+            'from "order-journal"'
+        ).fetchone()
+        return {
+            'depth': depth,
+            'lag_seconds': round(time.time() - oldest, 2) if oldest else 0.0,
+            'retrying': retried or 0,
+            'last_error': last_error,
+        }
+
+    def _connection(self):
+        return self._connections.get()
+
+
+class OrderFlusher:
+    """Background thread moving journaled orders into ``order-list`` in batches.
+
+    Failed batches go back to the journal and the thread backs off exponentially
+    (with jitter) up to ``max_backoff`` seconds.
+    """
+
+    def __init__(self, journal, repository, batch_size=100, interval=0.5, max_backoff=60):
+        self._journal = journal
+        self._repository = repository
+        self._batch_size = batch_size
+        self._interval = interval
+        self._max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self.flushed = 0
+        self.failures = 0
+        self.last_flush_at = None
+        self.last_flush_seconds = None
+
+    def ensure_running(self):
+        """Start the thread in this process (again after a fork, which doesn't copy it)."""
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        with self._lock:
+            if pid == self._pid:
+                return
+            self._pid = pid
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def flush(self):
+        """Flush everything that is in the journal now; returns the number of orders stored."""
+        total = 0
+        while True:
+            flushed = self._flush_batch()
+            total += flushed
+            if flushed < self._batch_size:
+                return total
+
+    def stats(self):
+        stats = self._journal.stats()
+        stats.update({
+            'flushed': self.flushed,
+            'failures': self.failures,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_seconds': self.last_flush_seconds,
+        })
+        return stats
+
+    def _run(self):
+        backoff = 0
+        while True:
+            if backoff:
+                # New orders shouldn't cut a backoff short
+                time.sleep(backoff)
+            else:
+                self._wakeup.wait(self._interval)
+            self._wakeup.clear()
+            try:
+                while self._flush_batch() == self._batch_size:
+                    pass
+                backoff = 0
+            except Exception:
+                self.failures += 1
+                backoff = min(self._max_backoff, max(1, backoff * 2)) * random.uniform(0.8, 1.2)
+                log.exception('order_journal_flush_failed', extra={'retry_in': round(backoff, 1)})
+
+    def _flush_batch(self):
+        orders = self._journal.lease(f'{os.getpid()}', limit=self._batch_size)
+        if not orders:
+            return 0
+
+        order_ids = [order['order_id'] for order in orders]
+        started = time.perf_counter()
+        try:
+            # Reserves stock for just this batch; a full recount would rescan
+            # every order kept in order-list on each flush
+            self._repository.record_orders(orders)
+        except Exception as e:
+            self._journal.release(order_ids, str(e))
+            raise
+
+        self._journal.complete(order_ids)
+        self.flushed += len(orders)
+        self.last_flush_at = time.time()
+        self.last_flush_seconds = round(time.perf_counter() - started, 3)
+        return len(orders)
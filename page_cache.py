@@ -0,0 +1,94 @@
+"""Microcache for rendered pages.
+
+The storefront looks the same to every visitor until the menu or the stock
+changes, so :class:`PageCache` keeps the rendered HTML and hands it out
+again as long as the data it was rendered from hasn't moved on.
+
+Each entry is tagged with a ``version`` (any comparable value; ``home``
+uses the catalog and ledger versions). A lookup is served from memory if
+
+* the entry is younger than ``ttl`` - a floor, so a burst of orders during
+  a rush causes at most one render per ``ttl`` however fast stock moves;
+* or its version is still current and it is younger than ``max_age``
+  (a ``None`` version is never current, so only the floor applies).
+
+Otherwise the entry is stale. One request re-renders it while concurrent
+requests keep getting the stale copy for up to ``stale_ttl`` more seconds,
+so a re-render never queues a crowd of requests behind it.
+"""
+import hashlib
+import threading
+import time
+
+from compression import compress
+
+
+class CachedPage:
+    __slots__ = ('body', 'etag', 'version', 'rendered_at', 'encoded')
+
+    def __init__(self, body, version, rendered_at):
+        self.body = body
+        self.etag = hashlib.sha1(body.encode()).hexdigest()[:16]
+        self.version = version
+        self.rendered_at = rendered_at
+        self.encoded = {}
+
+    def encode(self, encoding):
+        """The body compressed with ``encoding``, compressed once per render."""
+        encoded = self.encoded.get(encoding)
+        if encoded is None:
+            encoded = self.encoded[encoding] = compress(self.body.encode(), encoding)
+        return encoded
+
+
+class PageCache:
+    """Rendered pages by name, re-rendered at most once at a time."""
+
+    def __init__(self, ttl=1, stale_ttl=10, max_age=60):
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._pages = {}  # name -> CachedPage
+        self._rendering = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.renders = 0
+
+    def get(self, name, version, render):
+        """The :class:`CachedPage` for ``name``, calling ``render()`` for the HTML if needed."""
+        now = time.monotonic()
+        with self._lock:
+            page = self._pages.get(name)
+            if page is not None:
+                age = now - page.rendered_at
+                if age < self._ttl or (version is not None and page.version == version and age < self._max_age):
+                    self.hits += 1
+                    return page
+                if name in self._rendering and age < self._ttl + self._stale_ttl:
+                    self.stale_hits += 1
+                    return page
+            self._rendering.add(name)
+
+        try:
+            page = CachedPage(render(), version, time.monotonic())
+        finally:
+            with self._lock:
+                self._rendering.discard(name)
+
+        with self._lock:
+            self.renders += 1
+            current = self._pages.get(name)
+            # A render that started earlier may finish after a newer one
+            if current is None or current.rendered_at <= page.rendered_at:
+                self._pages[name] = page
+        return page
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pages': len(self._pages),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'renders': self.renders,
+            }
@@ -0,0 +1,70 @@
+"""Run independent backend queries side by side.
+
+Pages like the admin dashboard need several Supabase queries that don't
+depend on each other: a page of orders, the menu, the ordered totals. Run
+one after the other they cost the sum of their round trips;
+:meth:`QueryPool.gather` runs them at once on a small per-process thread
+pool, so the page waits about as long as the slowest of them.
+
+Calls keep the caller's context variables (the request id in log lines) but
+not Flask's request context, so pass them plain repository or cache calls.
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class QueryPool:
+    """``max_workers`` threads shared by every request in the process.
+
+    The executor is created on first use in each process, so a pool built
+    before gunicorn forks doesn't hand workers a copy without threads.
+    ``max_workers=0`` runs every call in turn on the calling thread.
+    """
+
+    def __init__(self, max_workers=4):
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._local = threading.local()
+
+    def gather(self, *calls):
+        """Call each of ``calls`` concurrently; returns their results in order.
+
+        The last call runs on the calling thread while the others run on
+        the pool. If any call raises, the first exception in argument order
+        is re-raised once all of them have finished.
+        """
+        # A call that gathers from inside the pool runs inline rather than
+        # waiting on threads that may all be busy waiting on it
+        if self._max_workers == 0 or len(calls) < 2 or getattr(self._local, 'in_pool', False):
+            return [call() for call in calls]
+
+        executor = self._get_executor()
+        futures = [executor.submit(contextvars.copy_context().run, self._run, call) for call in calls[:-1]]
+        try:
+            last = calls[-1]()
+        except Exception:
+            wait(futures)
+            for future in futures:
+                error = future.exception()
+                if error is not None:
+                    raise error
+            raise
+        return [future.result() for future in futures] + [last]
+
+    def _run(self, call):
+        self._local.in_pool = True
+        try:
+            return call()
+        finally:
+            self._local.in_pool = False
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='query-pool')
+                self._executor_pid = os.getpid()
+            return self._executor
@@ -0,0 +1,325 @@
+"""Atomic stock reservation for new orders.
+
+Placing an order checks every line item against the stock that is left in
+the order's sale (refusing lines for less than one unit) and inserts the order in a single transaction, so
+concurrent buyers cannot oversell an item. Each ``sale-items`` row carries a
+``reserved`` counter that is bumped by the reservation and given back when
+orders are deleted. ``record_orders`` stores orders the write-behind journal
+has already checked and bumps the counters by their line items alone.
+
+``SupabaseReserver`` runs the check-and-insert inside Postgres functions (see
+``migrations/002_place_order_atomic.sql``) so it costs one round trip.
+``SQLiteReserver`` does the same against a local SQLite database, which lets
+the concurrency behaviour be load-tested without Supabase.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from sqlite_connections import ThreadLocalConnections, connect
+
+
+class InsufficientStock(Exception):
+    """Raised when an order asks for more than is left of one or more items.
+
+    ``shortfalls`` holds one ``{item_id, name, requested, available}`` dict per
+    item that could not be reserved; nothing is reserved when this is raised.
+    """
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__(", ".join(
+            f"{s['name']} (requested {s['requested']}, available {s['available']})" for s in shortfalls
+        ))
+
+
+def requested_quantities(line_items):
+    """Total quantity asked for per item id across an order's line items."""
+    requested = {}
+    for line in line_items:
+        requested[line['item_id']] = requested.get(line['item_id'], 0) + int(line['quantity'])
+    return requested
+
+
+def check_line_quantities(line_items):
+    """Raise ValueError unless every line item asks for at least one unit.
+
+    A line with a quantity below one would hand units back to ``reserved``
+    and let other orders sell them twice.
+    """
+    for line in line_items:
+        if int(line['quantity']) < 1:
+            raise ValueError(f"Invalid quantity {line['quantity']} for {line.get('name', line['item_id'])}")
+
+
+class SupabaseReserver:
+    """Reservation through the Postgres functions in ``migrations/``.
+
+    Pass ``client_factory`` instead of ``client`` to have each process build
+    its own Supabase client on first use, so a repository created before
+    gunicorn forks never shares an HTTP connection pool between workers.
+    """
+
+    def __init__(self, client=None, client_factory=None):
+        self._client_factory = client_factory
+        self._client_instance = client
+        self._client_pid = os.getpid() if client is not None else None
+
+    @property
+    def _client(self):
+        if self._client_pid != os.getpid():
+            self._client_instance = self._client_factory()
+            self._client_pid = os.getpid()
+        return self._client_instance
+
+    def place_order(self, order_data):
+        """Reserve stock for and insert ``order_data``; returns the inserted row."""
+        check_line_quantities(order_data.get('line_items', []))
+        result = self._client.rpc('place_order_atomic', {'p_order': order_data}).execute().data
+        if not result.get('success'):
+            raise InsufficientStock(result.get('shortfalls', []))
+        return result['order']
+
+    def record_orders(self, orders):
+        """Insert already checked orders and reserve their stock; returns how many were new.
+
+        Ids already stored are skipped along with their stock, so a batch
+        can be retried safely.
+        """
+        if not orders:
+            return 0
+        rows = [{column: order.get(column) for column in ORDER_COLUMNS} for order in orders]
+        return self._client.rpc('record_orders', {'p_orders': rows}).execute().data
+
+    def delete_order(self, order_id):
+        """Delete an order and release its stock; returns the deleted rows."""
+        return self._client.rpc('delete_order_atomic', {'p_order_id': int(order_id)}).execute().data or []
+
+    def recount(self):
+        """Recompute every ``reserved`` counter from the orders left in the table."""
+        self._client.rpc('recount_reserved_stock', {}).execute()
+
+
+SQLITE_SCHEMA = """
+create table if not exists "food-items" (
+    id integer primary key,
+    name text not null,
+    price real not null default 0,
+    quantity integer not null default 0,
+    image text,
+    "Description" text
+);
+
+create table if not exists "order-list" (
+    order_id integer primary key,
+    customer_name text,
+    phone integer,
+    membership integer,
+    item text,
+    quantity integer,
+    line_items text,
+    sale_id integer
+);
+
+create table if not exists "order-archive" (
+    order_id integer primary key,
+    customer_name text,
+    phone integer,
+    membership integer,
+    item text,
+    quantity integer,
+    line_items text,
+    archived_at text not null default current_timestamp,
+    sale_id integer
+);
+
+create table if not exists sales (
+    id integer primary key,
+    name text not null,
+    sale_date text,
+    opens_at text,
+    closes_at text,
+    created_at text not null default current_timestamp
+);
+
+create table if not exists "sale-items" (
+    sale_id integer not null,
+    item_id integer not null,
+    quantity integer not null default 0,
+    reserved integer not null default 0,
+    primary key (sale_id, item_id)
+);
+
+create view if not exists "sale-menu" as
+    select f.id, f.name, f.price, f.image, f."Description", s.sale_id, s.quantity, s.reserved
+    from "food-items" f
+    join "sale-items" s on s.item_id = f.id;
+"""
+
+SQLITE_INDEXES = """
+create index if not exists order_list_sale_id_idx on "order-list" (sale_id, order_id);
+"""
+
+ORDER_COLUMNS = ('order_id', 'customer_name', 'phone', 'membership', 'item', 'quantity', 'line_items', 'sale_id')
+
+
+class SQLiteReserver:
+    """The same reservation semantics on a local SQLite database.
+
+    File databases use one connection per thread and ``BEGIN IMMEDIATE`` so
+    SQLite's own write lock serialises reservations, just as row locks do in
+    Postgres. Connections opened before a fork are never reused by the child.
+    ``:memory:`` databases can't be shared between connections, so they use
+    a single connection guarded by a lock instead (and each process has its
+    own copy of the data).
+    """
+
+    def __init__(self, path=':memory:', timeout=30):
+        self._connections = ThreadLocalConnections(path, timeout=timeout, row_factory=sqlite3.Row)
+        self._memory_lock = threading.Lock() if path == ':memory:' else None
+        self._memory_conn = connect(path, timeout=timeout, row_factory=sqlite3.Row) if path == ':memory:' else None
+
+        # executescript commits on its own, so it can't run inside _transaction()
+        conn = self._connection()
+        conn.executescript(SQLITE_SCHEMA)
+        # Databases created before sales existed lack the sale_id columns
+        for table in ('order-list', 'order-archive'):
+            if 'sale_id' not in {row[1] for row in conn.execute(f'pragma table_info("{table}")')}:
+                conn.execute(f'alter table "{table}" add column sale_id integer')
+        conn.executescript(SQLITE_INDEXES)
+
+    def seed_items(self, items):
+        """Insert or replace menu rows (``id``, ``name``, ``price``, ``quantity``...)."""
+        with self._transaction() as conn:
+            conn.executemany(
+                'insert or replace into "food-items" (id, name, price, quantity, image, "Description") '
+                'values (?, ?, ?, ?, ?, ?)',
+                [(item['id'], item['name'], item.get('price', 0), item.get('quantity', 0),
+                  item.get('image'), item.get('Description')) for item in items],
+            )
+
+    def place_order(self, order_data):
+        check_line_quantities(order_data.get('line_items', []))
+        requested = requested_quantities(order_data.get('line_items', []))
+        sale_id = order_data.get('sale_id')
+
+        with self._transaction() as conn:
+            placeholders = ', '.join('?' for _ in requested)
+            rows = conn.execute(
+                f'select item_id, quantity - reserved from "sale-items" where sale_id = ? and item_id in ({placeholders})',
+                [sale_id, *requested],
+            ).fetchall() if requested else []
+            available = dict(rows)
+
+            shortfalls = []
+            for item_id, quantity in requested.items():
+                left = available.get(item_id, 0)
+                if quantity > left:
+                    name = next((line['name'] for line in order_data['line_items'] if line['item_id'] == item_id), str(item_id))
+                    shortfalls.append({'item_id': item_id, 'name': name, 'requested': quantity, 'available': max(left, 0)})
+            if shortfalls:
+                raise InsufficientStock(shortfalls)
+
+            conn.executemany(
+                'update "sale-items" set reserved = reserved + ? where sale_id = ? and item_id = ?',
+                [(quantity, sale_id, item_id) for item_id, quantity in requested.items()],
+            )
+            row = self._order_row(order_data)
+            conn.execute(
+                f'insert into "order-list" ({", ".join(row)}) values ({", ".join("?" for _ in row)})',
+                list(row.values()),
+            )
+        return dict(order_data)
+
+    def record_orders(self, orders):
+        reserved = {}
+        inserted = 0
+        with self._transaction() as conn:
+            for order in orders:
+                row = self._order_row(order)
+                cursor = conn.execute(
+                    f'insert or ignore into "order-list" ({", ".join(row)}) values ({", ".join("?" for _ in row)})',
+                    list(row.values()),
+                )
+                if not cursor.rowcount:
+                    continue
+                inserted += 1
+                for item_id, quantity in requested_quantities(order.get('line_items') or []).items():
+                    key = (order.get('sale_id'), item_id)
+                    reserved[key] = reserved.get(key, 0) + quantity
+            conn.executemany(
+                'update "sale-items" set reserved = reserved + ? where sale_id = ? and item_id = ?',
+                [(quantity, sale_id, item_id) for (sale_id, item_id), quantity in reserved.items()],
+            )
+        return inserted
+
+    def delete_order(self, order_id):
+        with self._transaction() as conn:
+            rows = conn.execute('select * from "order-list" where order_id = ?', (int(order_id),)).fetchall()
+            deleted = [self._decode_order(row) for row in rows]
+            for order in deleted:
+                conn.executemany(
+                    'update "sale-items" set reserved = max(reserved - ?, 0) where sale_id = ? and item_id = ?',
+                    [(quantity, order.get('sale_id'), item_id)
+                     for item_id, quantity in requested_quantities(order.get('line_items') or []).items()],
+                )
+            conn.execute('delete from "order-list" where order_id = ?', (int(order_id),))
+        return deleted
+
+    def recount(self):
+        with self._transaction() as conn:
+            reserved = {}
+            for sale_id, line_items in conn.execute(
+                    'select sale_id, line_items from "order-list" where line_items is not null'):
+                for item_id, quantity in requested_quantities(json.loads(line_items)).items():
+                    reserved[sale_id, item_id] = reserved.get((sale_id, item_id), 0) + quantity
+            conn.execute('update "sale-items" set reserved = 0')
+            conn.executemany('update "sale-items" set reserved = ? where sale_id = ? and item_id = ?',
+                             [(quantity, sale_id, item_id) for (sale_id, item_id), quantity in reserved.items()])
+
+    def _connection(self):
+        if self._memory_conn is not None:
+            return self._memory_conn
+        return self._connections.get()
+
+    @contextmanager
+    def _reading(self):
+        # WAL readers don't block writers, so plain reads skip BEGIN IMMEDIATE
+        if self._memory_lock is not None:
+            with self._memory_lock:
+                yield self._memory_conn
+        else:
+            yield self._connection()
+
+    @contextmanager
+    def _transaction(self):
+        if self._memory_lock is not None:
+            with self._memory_lock:
+                yield from self._run_transaction(self._memory_conn)
+        else:
+            yield from self._run_transaction(self._connection())
+
+    @staticmethod
+    def _run_transaction(conn):
+        conn.execute('begin immediate')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('rollback')
+            raise
+        conn.execute('commit')
+
+    @staticmethod
+    def _order_row(order_data):
+        row = {column: order_data.get(column) for column in ORDER_COLUMNS}
+        row['line_items'] = json.dumps(row['line_items']) if row['line_items'] is not None else None
+        return row
+
+    @staticmethod
+    def _decode_order(row):
+        order = dict(row)
+        if order.get('line_items'):
+            order['line_items'] = json.loads(order['line_items'])
+        return order
@@ -0,0 +1,111 @@
+"""Sale events.
+
+Each food sale is a row in ``sales`` with its own opening window and its
+own stock in ``sale-items``; orders carry the ``sale_id`` they were placed
+in (see ``migrations/004_sales.sql``). Everything the storefront and the
+admin page do is scoped to the current sale, so the orders of past sales
+can stay in ``order-list`` without slowing down stock checks.
+
+Sales are created in the Supabase dashboard (or with
+``repository.create_sale``). The current sale is the one that opened most
+recently; it takes orders until its ``closes_at`` passes.
+"""
+import threading
+import time
+from datetime import date, datetime, timezone
+
+_UNSEEN = object()
+
+
+def parse_timestamp(value):
+    """An aware datetime from a ``timestamptz`` as PostgREST or SQLite return it."""
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(value.replace(' ', 'T'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def is_open(sale, now=None):
+    """Whether ``sale`` is taking orders at ``now`` (default: now)."""
+    if sale is None:
+        return False
+    now = now or datetime.now(timezone.utc)
+    opens_at = parse_timestamp(sale.get('opens_at'))
+    closes_at = parse_timestamp(sale.get('closes_at'))
+    return (opens_at is None or opens_at <= now) and (closes_at is None or now < closes_at)
+
+
+def format_sale_date(sale):
+    """``"May 31, 2025"`` for the sale's ``sale_date``, or '' if it has none."""
+    value = sale.get('sale_date') if sale else None
+    if not value:
+        return ''
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return f"{value:%B} {value.day}, {value.year}"
+
+
+class SaleCalendar:
+    """The list of sales, re-read every ``ttl`` seconds.
+
+    ``load_sales`` returns every ``sales`` row. Listeners registered with
+    :meth:`add_listener` are called with the new sale when the current sale
+    changes, so caches built for the previous one can be dropped.
+    """
+
+    def __init__(self, load_sales, ttl=30):
+        self._load_sales = load_sales
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._sales = None
+        self._expires_at = 0.0
+        self._current_id = _UNSEEN
+        self._listeners = []
+
+    def current(self):
+        """The sale that opened most recently, or None before the first one opens."""
+        now = datetime.now(timezone.utc)
+        # all_sales() is sorted most recent first
+        sale = next((sale for sale in self.all_sales() if sale['opens_at'] is None or sale['opens_at'] <= now), None)
+
+        sale_id = sale['id'] if sale else None
+        with self._lock:
+            changed = self._current_id is not _UNSEEN and sale_id != self._current_id
+            self._current_id = sale_id
+        if changed:
+            for callback in self._listeners:
+                callback(sale)
+        return sale
+
+    def current_id(self):
+        sale = self.current()
+        return sale['id'] if sale else None
+
+    def get(self, sale_id):
+        return next((sale for sale in self.all_sales() if str(sale['id']) == str(sale_id)), None)
+
+    def all_sales(self):
+        """Every sale, most recent first, with ``opens_at``/``closes_at`` as datetimes."""
+        with self._lock:
+            if self._sales is not None and self._expires_at > time.monotonic():
+                return self._sales
+        sales = sorted(
+            (dict(sale, opens_at=parse_timestamp(sale.get('opens_at')), closes_at=parse_timestamp(sale.get('closes_at')))
+             for sale in self._load_sales()),
+            key=self._opening_order, reverse=True)
+        with self._lock:
+            self._sales = sales
+            self._expires_at = time.monotonic() + self._ttl
+        return sales
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def invalidate(self):
+        with self._lock:
+            self._sales = None
+
+    @staticmethod
+    def _opening_order(sale):
+        # Sales without an opening time have always been open
+        return (sale['opens_at'] or datetime.min.replace(tzinfo=timezone.utc), sale['id'])
@@ -0,0 +1,156 @@
+"""Runtime settings shared by every worker on the host.
+
+Each gunicorn worker is its own process, so flipping a module global (as
+``toggle_bookings`` used to) only changed the worker that served the POST.
+:class:`SharedState` keeps the bookings status and the cache-invalidation
+epochs in a small memory-mapped file instead. Every worker maps the same
+file, so a change is visible to all of them on their next read.
+
+It also holds the waiting room's next admission slot, so workers hand out
+queue positions from one sequence.
+
+Reads are a seqlock over a 48-byte struct: no system call, no lock and no
+database round trip, cheap enough to do on every request. Writers take an
+``flock`` on the file, bump the sequence number to odd, update the fields
+and bump it back to even; readers retry if they saw an odd or changed
+sequence.
+
+The file survives restarts, so the last admin toggle stays in force unless
+``BOOKINGS_CLOSED`` is set: an explicit value is applied every time the
+server starts (``on_starting`` in ``gunicorn.conf.py``, or ``python
+main.py``), as it always was. It only covers one host - workers on several
+machines would need a shared settings row.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+_LAYOUT = struct.Struct('<4s4xQQQQQ')  # magic, sequence, bookings_closed, menu_epoch, stock_epoch, queue_slot
+_SEQUENCE = struct.Struct('<Q')
+_SEQUENCE_OFFSET = 8
+_FIELDS_OFFSET = 16
+_FIELD_VALUES = struct.Struct('<QQQQ')
+_MAGIC = b'MOMS'
+FIELDS = ('bookings_closed', 'menu_epoch', 'stock_epoch', 'queue_slot')
+
+
+def bookings_closed_setting(environ=os.environ):
+    """``BOOKINGS_CLOSED`` as a bool, or None when it isn't set."""
+    value = environ.get('BOOKINGS_CLOSED')
+    return None if value is None else value.lower() == 'true'
+
+
+class SharedState:
+    """Versioned bookings status and cache epochs in a shared mmap."""
+
+    def __init__(self, path='shared_state.bin', bookings_closed=False):
+        self._path = path
+        self._lock = threading.Lock()
+        self._lock_fd = None
+        self._lock_pid = None
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            size = os.fstat(fd).st_size
+            if size == 0:
+                os.pwrite(fd, _LAYOUT.pack(_MAGIC, 0, int(bookings_closed), 0, 0, 0), 0)
+            elif size < _LAYOUT.size:
+                # Written by an older version: new fields start at zero
+                os.ftruncate(fd, _LAYOUT.size)
+            self._map = mmap.mmap(fd, _LAYOUT.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+        if self._read()[0] != _MAGIC:
+            raise ValueError(f"{path} is not a shared state file")
+        # Forked workers inherit this along with the caches it describes
+        self._seen = self.snapshot()
+
+    @property
+    def version(self):
+        return self._read()[1] // 2
+
+    def snapshot(self):
+        """``{bookings_closed, menu_epoch, stock_epoch, queue_slot, version}`` as of now."""
+        _, sequence, bookings_closed, menu_epoch, stock_epoch, queue_slot = self._read()
+        return {
+            'bookings_closed': bool(bookings_closed),
+            'menu_epoch': menu_epoch,
+            'stock_epoch': stock_epoch,
+            'queue_slot': queue_slot,
+            'version': sequence // 2,
+        }
+
+    def get(self, field):
+        return self.snapshot()[field]
+
+    def set_bookings_closed(self, closed):
+        return self._update(bookings_closed=int(bool(closed)))
+
+    def bump(self, epoch):
+        """Advance ``menu_epoch`` or ``stock_epoch`` so other workers drop their caches."""
+        return self._update(**{epoch: None})
+
+    def claim_queue_slot(self, interval, burst):
+        """Next waiting-room admission time (epoch seconds), for :class:`admission.WaitingRoom`."""
+        now = int(time.time() * 1e6)
+        step = int(interval * 1e6)
+        snapshot = self._update(queue_slot=lambda slot: max(slot, now - burst * step) + step)
+        return snapshot['queue_slot'] / 1e6
+
+    def changes(self):
+        """Fields that changed since the last call in this process, or ``{}``."""
+        current = self.snapshot()
+        with self._lock:
+            if current['version'] == self._seen['version']:
+                return {}
+            changed = {field: current[field] for field in FIELDS if current[field] != self._seen[field]}
+            self._seen = current
+        return changed
+
+    def _read(self):
+        while True:
+            values = _LAYOUT.unpack_from(self._map, 0)
+            # An odd sequence means a write is in progress; a moved one means
+            # the fields we read may be torn
+            if values[1] % 2 == 0 and _SEQUENCE.unpack_from(self._map, _SEQUENCE_OFFSET)[0] == values[1]:
+                return values
+
+    def _update(self, **fields):
+        with self._lock:
+            fd = self._locking_fd()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                _, sequence, *values = _LAYOUT.unpack_from(self._map, 0)
+                current = dict(zip(FIELDS, values))
+                for field, value in fields.items():
+                    if value is None:
+                        current[field] += 1
+                    elif callable(value):
+                        current[field] = value(current[field])
+                    else:
+                        current[field] = value
+                _SEQUENCE.pack_into(self._map, _SEQUENCE_OFFSET, sequence + 1)
+                _FIELD_VALUES.pack_into(self._map, _FIELDS_OFFSET, *(current[field] for field in FIELDS))
+                _SEQUENCE.pack_into(self._map, _SEQUENCE_OFFSET, sequence + 2)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            # This process has already acted on its own change; only skip it
+            # if nothing else happened since we last looked
+            snapshot = dict(current, bookings_closed=bool(current['bookings_closed']), version=sequence // 2 + 1)
+            if self._seen['version'] == sequence // 2:
+                self._seen = snapshot
+        return snapshot
+
+    def _locking_fd(self):
+        # flock is held per open file, and a forked child shares its parent's,
+        # so each process needs its own descriptor for the lock to exclude
+        if self._lock_pid != os.getpid():
+            self._lock_fd = os.open(self._path, os.O_RDWR)
+            self._lock_pid = os.getpid()
+        return self._lock_fd
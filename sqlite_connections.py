@@ -0,0 +1,47 @@
+"""Per-thread SQLite connections that are safe across gunicorn's fork.
+
+The reservation database, the order journal and the cart store all keep one
+autocommit connection per thread (callers begin their own transactions) on
+a WAL-mode file, so readers never block the writer. A connection opened in
+the gunicorn master must not be used by a worker, so every process opens
+its own.
+"""
+import os
+import sqlite3
+import threading
+
+
+def connect(path, timeout=30, synchronous=None, row_factory=None):
+    """An autocommit connection to ``path``, in WAL mode unless it is ``:memory:``.
+
+    ``synchronous`` sets the pragma of that name (``full``, ``normal``...);
+    None keeps SQLite's default.
+    """
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    if path != ':memory:':
+        conn.execute('pragma journal_mode=wal')
+    if synchronous is not None:
+        conn.execute(f'pragma synchronous={synchronous}')
+    return conn
+
+
+class ThreadLocalConnections:
+    """One :func:`connect` connection per thread of the current process."""
+
+    def __init__(self, path, timeout=30, synchronous=None, row_factory=None):
+        self._path = path
+        self._options = {'timeout': timeout, 'synchronous': synchronous, 'row_factory': row_factory}
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def get(self):
+        # Never reuse a connection opened before a fork
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self._path, **self._options)
+        return conn
@@ -0,0 +1,81 @@
+"""Fingerprinted, precompressed static files.
+
+:class:`StaticAssets` reads ``static/`` once at start-up, hashes every file
+and keeps gzip (and, if available, brotli) encodings of the compressible
+ones at maximum compression. ``url_for('static', filename=...)`` then adds
+``?v=<hash>``, and a request for the current hash is served with a
+year-long ``immutable`` Cache-Control: browsers never ask again until the
+file changes and the templates point at a new hash.
+
+Files added to ``static/`` after start-up are not served until a restart.
+"""
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, abort, request
+
+from compression import BROTLI_AVAILABLE, COMPRESSIBLE_TYPES, STATIC_LEVELS, accepted_encoding, compress
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class Asset:
+    __slots__ = ('data', 'mimetype', 'digest', 'encoded')
+
+    def __init__(self, data, mimetype):
+        self.data = data
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        self.encoded = {}  # encoding -> bytes, only where it is actually smaller
+        if mimetype in COMPRESSIBLE_TYPES:
+            for encoding in ('br', 'gzip') if BROTLI_AVAILABLE else ('gzip',):
+                encoded = compress(data, encoding, STATIC_LEVELS[encoding])
+                if len(encoded) < len(data):
+                    self.encoded[encoding] = encoded
+
+
+class StaticAssets:
+    def __init__(self, folder):
+        self._assets = {}
+        for root, _, files in os.walk(folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                self._assets[filename] = Asset(data, mimetype)
+
+    def fingerprint(self, filename):
+        asset = self._assets.get(filename)
+        return asset.digest if asset is not None else None
+
+    def add_fingerprint(self, endpoint, values):
+        """``url_defaults`` callback adding ``v=<hash>`` to static URLs."""
+        if endpoint == 'static' and 'v' not in values:
+            digest = self.fingerprint(values.get('filename'))
+            if digest is not None:
+                values['v'] = digest
+
+    def serve(self, filename):
+        """View for ``/static/<path:filename>``."""
+        asset = self._assets.get(filename)
+        if asset is None:
+            abort(404)
+
+        data = asset.data
+        headers = {'Vary': 'Accept-Encoding'} if asset.encoded else {}
+        encoding = accepted_encoding(request.accept_encodings)
+        if encoding in asset.encoded:
+            data = asset.encoded[encoding]
+            headers['Content-Encoding'] = encoding
+
+        response = Response(data, mimetype=asset.mimetype, headers=headers)
+        response.set_etag(asset.digest, weak=bool(asset.encoded))
+        # Only a URL naming this exact content may be cached for good
+        if request.args.get('v') == asset.digest:
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
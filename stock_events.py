@@ -0,0 +1,125 @@
+"""Server-Sent Events fan-out of remaining stock to the storefront.
+
+One :class:`StockBroadcaster` per worker holds a small queue for every open
+``/stock/stream`` connection. The stock ledger publishes remaining-quantity
+deltas to it whenever an order is placed or deleted (or a reconcile picks up
+orders from another worker), and each connection just drains its queue, so
+connected browsers never query the database themselves.
+
+Every connection holds a request thread for as long as it is open, so the
+broadcaster takes at most ``max_subscribers`` of them (a fraction of
+gunicorn's threads, see ``STOCK_STREAM_MAX`` in main.py). Past that
+``/stock/stream`` answers 503 and the storefront polls ``/api/stock``
+instead, which leaves the threads free for actual page requests.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class StockBroadcaster:
+    """Shared publisher behind every ``/stock/stream`` connection.
+
+    ``refresh`` is called from a single background thread every
+    ``keepalive`` seconds while anyone is subscribed; it is there to nudge
+    the stock ledger into reconciling, so changes made through other
+    workers still reach idle storefronts. Subscribers that fall
+    ``max_queue`` events behind are dropped; ``EventSource`` reconnects on
+    its own and starts again from a fresh snapshot. At most
+    ``max_subscribers`` connections are served at once (None: no limit).
+    """
+
+    def __init__(self, refresh=None, keepalive=15, max_queue=100, max_subscribers=None):
+        self._refresh = refresh
+        self._keepalive = keepalive
+        self._max_queue = max_queue
+        self._max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._event_id = 0
+        self._ticker = None
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """A new subscription, or None if ``max_subscribers`` are already connected."""
+        subscription = queue.Queue(maxsize=self._max_queue)
+        with self._lock:
+            if self._max_subscribers is not None and len(self._subscribers) >= self._max_subscribers:
+                return None
+            self._subscribers.add(subscription)
+            if self._ticker is None or not self._ticker.is_alive():
+                self._ticker = threading.Thread(target=self._tick, daemon=True)
+                self._ticker.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, items):
+        """Send ``{item_id: {remaining, out_of_stock}}`` to every subscriber."""
+        if not items or not self._subscribers:
+            return
+        with self._lock:
+            self._event_id += 1
+            message = self._format('stock', items, self._event_id)
+            for subscription in list(self._subscribers):
+                try:
+                    subscription.put_nowait(message)
+                except queue.Full:
+                    # A stalled client shouldn't hold events for everyone else
+                    self._subscribers.discard(subscription)
+                    self._close(subscription)
+
+    def stream(self, subscription, snapshot=None):
+        """Yield SSE text for one connection, starting with ``snapshot`` if given."""
+        try:
+            yield f'retry: {self._keepalive * 1000}\n\n'
+            if snapshot:
+                yield self._format('stock', snapshot, self._event_id)
+            while True:
+                try:
+                    message = subscription.get(timeout=self._keepalive)
+                except queue.Empty:
+                    # Comment line so proxies don't time out an idle stream
+                    yield ': keepalive\n\n'
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    def _tick(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._ticker = None
+                    return
+            time.sleep(self._keepalive)
+            if self._refresh is not None:
+                try:
+                    self._refresh()
+                except Exception:
+                    log.exception('stock_stream_refresh_failed')
+
+    @staticmethod
+    def _close(subscription):
+        # Make room for the sentinel that ends the stream
+        try:
+            while True:
+                subscription.get_nowait()
+        except queue.Empty:
+            pass
+        subscription.put_nowait(None)
+
+    @staticmethod
+    def _format(event, data, event_id):
+        return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
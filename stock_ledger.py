@@ -0,0 +1,164 @@
+"""In-process ledger of how many units of each food item have been ordered.
+
+The ledger is seeded once from ``order-list`` and then kept up to date by the
+routes that change orders, so stock checks no longer need to scan every order
+ever placed. Because each gunicorn worker keeps its own ledger, it is also
+reconciled against the database every ``reconcile_interval`` seconds to pick
+up orders placed through other workers.
+
+Listeners registered with :meth:`StockLedger.add_listener` are told about
+every change, whichever of those paths it came from.
+"""
+import logging
+import threading
+import time
+
+from order_items import count_ordered_items
+
+log = logging.getLogger(__name__)
+
+
+class StockLedger:
+    """Per-item ordered totals with O(1) lookups.
+
+    ``load_orders`` is a callable returning every row of ``order-list``; it is
+    only used to seed the ledger and for periodic reconciliation.
+    """
+
+    def __init__(self, load_orders, reconcile_interval=30):
+        self._load_orders = load_orders
+        self._reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._ordered = {}
+        self._seeded = False
+        self._last_reconciled = 0.0
+        self._reconciling = False
+        # Deltas applied while a background reconcile is reading the table
+        self._pending = []
+        self._listeners = []
+        self._version = 0
+
+    @property
+    def version(self):
+        """Bumped on every change to the totals, for keying caches of what they show."""
+        self._ensure_fresh()
+        return self._version
+
+    @property
+    def seeded(self):
+        """Whether the first load from ``order-list`` has happened."""
+        return self._seeded
+
+    def ordered(self, item_name):
+        self._ensure_fresh()
+        return self._ordered.get(item_name, 0)
+
+    def remaining(self, item):
+        """Units of ``item`` (a ``food-items`` row) still available."""
+        return item.get('quantity', 0) - self.ordered(item['name'])
+
+    def snapshot(self):
+        self._ensure_fresh()
+        with self._lock:
+            return dict(self._ordered)
+
+    def record(self, quantities):
+        """Add a newly placed order's ``{item_name: quantity}`` to the ledger."""
+        self._apply(quantities, 1)
+
+    def release(self, quantities):
+        """Remove a deleted order's ``{item_name: quantity}`` from the ledger."""
+        self._apply(quantities, -1)
+
+    def add_listener(self, callback):
+        """Call ``callback({item_name: ordered})`` with the new totals after every change."""
+        self._listeners.append(callback)
+
+    def clear(self):
+        with self._lock:
+            changed = {item_name: 0 for item_name, quantity in self._ordered.items() if quantity}
+            self._ordered = {}
+            self._pending = []
+            self._seeded = True
+            self._last_reconciled = time.monotonic()
+        self._notify(changed)
+
+    def invalidate(self):
+        """Reconcile in the background on next use instead of waiting out the interval."""
+        with self._lock:
+            self._last_reconciled = float('-inf')
+
+    def reconcile(self):
+        """Rebuild the totals from ``order-list`` synchronously."""
+        with self._lock:
+            self._pending = []
+            self._reconciling = True
+        try:
+            ordered = count_ordered_items(self._load_orders())
+        except Exception:
+            with self._lock:
+                self._reconciling = False
+            raise
+
+        with self._lock:
+            # Orders recorded while we were reading may or may not be part of
+            # the rows we got back; re-applying them errs on the side of
+            # under-selling until the next reconcile.
+            for quantities, sign in self._pending:
+                for item_name, quantity in quantities.items():
+                    ordered[item_name] = ordered.get(item_name, 0) + sign * quantity
+            changed = {
+                item_name: ordered.get(item_name, 0)
+                for item_name in set(ordered) | set(self._ordered)
+                if ordered.get(item_name, 0) != self._ordered.get(item_name, 0)
+            }
+            self._ordered = ordered
+            self._pending = []
+            self._reconciling = False
+            self._seeded = True
+            self._last_reconciled = time.monotonic()
+        self._notify(changed)
+
+    def _apply(self, quantities, sign):
+        self._ensure_fresh()
+        changed = {}
+        with self._lock:
+            for item_name, quantity in quantities.items():
+                total = self._ordered.get(item_name, 0) + sign * quantity
+                self._ordered[item_name] = changed[item_name] = max(total, 0)
+            if self._reconciling:
+                self._pending.append((dict(quantities), sign))
+        self._notify(changed)
+
+    def _notify(self, changed):
+        if not changed:
+            return
+        with self._lock:
+            self._version += 1
+        for callback in self._listeners:
+            try:
+                callback(changed)
+            except Exception:
+                log.exception('stock_listener_failed')
+
+    def _ensure_fresh(self):
+        if not self._seeded:
+            self.reconcile()
+            return
+
+        if time.monotonic() - self._last_reconciled < self._reconcile_interval:
+            return
+
+        with self._lock:
+            if self._reconciling:
+                return
+            # Claim the slot so only one request triggers the refresh
+            self._last_reconciled = time.monotonic()
+
+        threading.Thread(target=self._reconcile_in_background, daemon=True).start()
+
+    def _reconcile_in_background(self):
+        try:
+            self.reconcile()
+        except Exception:
+            log.exception('stock_reconcile_failed')
@@ -0,0 +1,327 @@
+"""Storage backends for menu items and orders.
+
+The routes talk to a repository instead of the Supabase client directly, so
+the app can run against a local SQLite database for benchmarking and
+profiling. Both repositories expose the same methods:
+
+* ``list_food_items()`` / ``get_food_items(ids)`` / ``insert_food_items(rows)``;
+  given a ``sale_id`` the first two read that sale's menu and stock instead
+* ``list_sales()`` / ``create_sale(sale, items)``
+* ``list_orders(...)`` with keyset pagination and ``iter_orders(page_size)``,
+  optionally scoped to one ``sale_id``
+* ``insert_orders(rows, ignore_existing)`` and ``delete_orders(order_ids)`` for bulk writes
+* ``archive_orders(through)`` / ``delete_orders_through(through)`` to end a sale
+* ``place_order`` / ``record_orders`` / ``delete_order`` / ``recount`` from :mod:`reservation`
+
+``STORAGE_BACKEND`` selects the backend (``supabase`` by default, or
+``sqlite``); ``SQLITE_PATH`` points the SQLite backend at a file.
+``SUPABASE_TIMEOUT`` / ``SUPABASE_CONNECT_TIMEOUT`` bound every Supabase
+request, in seconds.
+"""
+import os
+
+from reservation import ORDER_COLUMNS, SQLiteReserver, SupabaseReserver
+
+# PostgREST puts in_() filters in the URL, so keep id lists well below its limits
+DELETE_CHUNK_SIZE = 200
+
+
+# (table, operation) labels for timing each repository method; iter_orders
+# is left out because it is timed through the list_orders pages it fetches
+REPOSITORY_OPERATIONS = {
+    'list_food_items': ('food-items', 'select'),
+    'get_food_items': ('food-items', 'select'),
+    'insert_food_items': ('food-items', 'upsert'),
+    'list_sales': ('sales', 'select'),
+    'create_sale': ('sales', 'insert'),
+    'list_orders': ('order-list', 'select'),
+    'insert_orders': ('order-list', 'insert'),
+    'delete_orders': ('order-list', 'delete'),
+    'delete_orders_through': ('order-list', 'delete'),
+    'archive_orders': ('order-archive', 'insert'),
+    'place_order': ('order-list', 'place_order_atomic'),
+    'record_orders': ('order-list', 'record_orders'),
+    'delete_order': ('order-list', 'delete_order_atomic'),
+    'recount': ('sale-items', 'recount_reserved_stock'),
+}
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class Repository:
+    """Methods shared by both backends, built on their ``list_orders``."""
+
+    def iter_orders(self, page_size=1000, columns='*', until=None, sale_id=None):
+        """Yield every order (of one sale, if given), one keyset page at a time."""
+        after = None
+        while True:
+            page = self.list_orders(columns=columns, limit=page_size, after=after, until=until, sale_id=sale_id)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]['order_id']
+
+
+class SupabaseRepository(Repository, SupabaseReserver):
+    """Repository backed by the Supabase REST API."""
+
+    def list_food_items(self, sale_id=None):
+        if sale_id is not None:
+            return self._client.table('sale-menu').select('*').eq('sale_id', sale_id).order('id').execute().data
+        return self._client.table('food-items').select('*').order('id').execute().data
+
+    def get_food_items(self, item_ids, sale_id=None):
+        if sale_id is not None:
+            return (self._client.table('sale-menu').select('*')
+                    .eq('sale_id', sale_id).in_('id', list(item_ids)).execute().data)
+        return self._client.table('food-items').select('*').in_('id', list(item_ids)).execute().data
+
+    def insert_food_items(self, rows):
+        return self._client.table('food-items').upsert(rows).execute().data
+
+    def list_sales(self):
+        return self._client.table('sales').select('*').execute().data
+
+    def create_sale(self, sale, items):
+        """Insert a ``sales`` row and its ``{item_id: quantity}`` stock; returns the sale."""
+        created = self._client.table('sales').insert(sale).execute().data[0]
+        if items:
+            self._client.table('sale-items').insert([
+                {'sale_id': created['id'], 'item_id': item_id, 'quantity': quantity}
+                for item_id, quantity in items.items()
+            ]).execute()
+        return created
+
+    def list_orders(self, columns='*', desc=False, limit=None, after=None, until=None, search=None, sale_id=None):
+        """Orders sorted by ``order_id``.
+
+        ``after`` is a keyset cursor: only orders past that id in the sort
+        direction are returned, which keeps deep pages as cheap as the first.
+        ``until`` caps the ids returned (inclusive), ``search`` matches the
+        customer name, or the phone number / order id exactly, and
+        ``sale_id`` limits the orders to one sale.
+        """
+        query = self._client.table('order-list').select(columns).order('order_id', desc=desc)
+        if sale_id is not None:
+            query = query.eq('sale_id', sale_id)
+        if search:
+            # postgrest-py has no or_() yet, so add PostgREST's or= parameter by hand
+            name = ''.join(c for c in search if c not in ',()*')
+            conditions = [f'customer_name.ilike.*{name}*']
+            if search.isdigit():
+                conditions += [f'phone.eq.{search}', f'order_id.eq.{search}']
+            query.params = query.params.add('or', f"({','.join(conditions)})")
+        if after is not None:
+            query = query.lt('order_id', after) if desc else query.gt('order_id', after)
+        if until is not None:
+            query = query.lte('order_id', until)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.execute().data
+
+    def insert_orders(self, rows, ignore_existing=False):
+        """Insert order rows; with ``ignore_existing`` ids already present are skipped."""
+        if not rows:
+            return []
+        if ignore_existing:
+            return (self._client.table('order-list')
+                    .upsert(list(rows), ignore_duplicates=True, on_conflict='order_id')
+                    .execute().data)
+        return self._client.table('order-list').insert(list(rows)).execute().data
+
+    def delete_orders(self, order_ids):
+        """Delete orders in chunked ``in_`` requests; returns the deleted rows.
+
+        This does not touch the ``reserved`` counters, so call :meth:`recount`
+        afterwards.
+        """
+        deleted = []
+        for chunk in _chunks(list(order_ids), DELETE_CHUNK_SIZE):
+            deleted.extend(self._client.table('order-list').delete().in_('order_id', chunk).execute().data or [])
+        return deleted
+
+    def delete_orders_through(self, through, sale_id=None):
+        """Delete every order with ``order_id <= through`` in one request; returns the count."""
+        from postgrest.types import CountMethod, ReturnMethod
+
+        query = (self._client.table('order-list')
+                 .delete(count=CountMethod.exact, returning=ReturnMethod.minimal)
+                 .lte('order_id', through))
+        if sale_id is not None:
+            query = query.eq('sale_id', sale_id)
+        return query.execute().count or 0
+
+    def archive_orders(self, through, batch_size=500, sale_id=None):
+        """Copy orders with ``order_id <= through`` into ``order-archive`` in batches."""
+        archived = 0
+        batch = []
+        for order in self.iter_orders(page_size=batch_size, until=through, sale_id=sale_id):
+            batch.append(order)
+            if len(batch) == batch_size:
+                archived += self._archive_batch(batch)
+                batch = []
+        if batch:
+            archived += self._archive_batch(batch)
+        return archived
+
+    def _archive_batch(self, orders):
+        from postgrest.types import ReturnMethod
+
+        # upsert keeps a re-run after a partial failure from tripping on duplicates
+        (self._client.table('order-archive')
+         .upsert(orders, returning=ReturnMethod.minimal, on_conflict='order_id')
+         .execute())
+        return len(orders)
+
+
+class SQLiteRepository(Repository, SQLiteReserver):
+    """Repository backed by a local SQLite database (``:memory:`` by default)."""
+
+    def list_food_items(self, sale_id=None):
+        with self._reading() as conn:
+            if sale_id is not None:
+                return [dict(row) for row in conn.execute(
+                    'select * from "sale-menu" where sale_id = ? order by id', (sale_id,))]
+            return [dict(row) for row in conn.execute('select * from "food-items" order by id')]
+
+    def get_food_items(self, item_ids, sale_id=None):
+        item_ids = list(item_ids)
+        if not item_ids:
+            return []
+        placeholders = ', '.join('?' for _ in item_ids)
+        with self._reading() as conn:
+            if sale_id is not None:
+                return [dict(row) for row in conn.execute(
+                    f'select * from "sale-menu" where sale_id = ? and id in ({placeholders}) order by id',
+                    [sale_id, *item_ids])]
+            return [dict(row) for row in conn.execute(
+                f'select * from "food-items" where id in ({placeholders}) order by id', item_ids)]
+
+    def insert_food_items(self, rows):
+        self.seed_items(rows)
+        return list(rows)
+
+    def list_sales(self):
+        with self._reading() as conn:
+            return [dict(row) for row in conn.execute('select * from sales')]
+
+    def create_sale(self, sale, items):
+        columns = list(sale)
+        with self._transaction() as conn:
+            sale_id = conn.execute(
+                f'insert into sales ({", ".join(columns)}) values ({", ".join("?" for _ in columns)})',
+                [sale[column] for column in columns],
+            ).lastrowid
+            conn.executemany('insert into "sale-items" (sale_id, item_id, quantity) values (?, ?, ?)',
+                             [(sale_id, item_id, quantity) for item_id, quantity in items.items()])
+            return dict(conn.execute('select * from sales where id = ?', (sale_id,)).fetchone())
+
+    def list_orders(self, columns='*', desc=False, limit=None, after=None, until=None, search=None, sale_id=None):
+        sql = f'select {columns} from "order-list" where 1 = 1'
+        params = []
+        if sale_id is not None:
+            sql += ' and sale_id = ?'
+            params.append(sale_id)
+        if search:
+            if search.isdigit():
+                sql += ' and (customer_name like ? or phone = ? or order_id = ?)'
+                params += [f'%{search}%', int(search), int(search)]
+            else:
+                sql += ' and customer_name like ?'
+                params.append(f'%{search}%')
+        if after is not None:
+            sql += ' and order_id < ?' if desc else ' and order_id > ?'
+            params.append(after)
+        if until is not None:
+            sql += ' and order_id <= ?'
+            params.append(until)
+        sql += ' order by order_id desc' if desc else ' order by order_id'
+        if limit is not None:
+            sql += ' limit ?'
+            params.append(limit)
+        with self._reading() as conn:
+            return [self._decode_order(row) for row in conn.execute(sql, params)]
+
+    def insert_orders(self, rows, ignore_existing=False):
+        rows = [self._order_row(row) for row in rows]
+        if not rows:
+            return []
+        columns = list(rows[0])
+        with self._transaction() as conn:
+            conn.executemany(
+                f'insert {"or ignore " if ignore_existing else ""}into "order-list" ({", ".join(columns)}) values ({", ".join("?" for _ in columns)})',
+                [[row[column] for column in columns] for row in rows],
+            )
+        return [self._decode_order(row) for row in rows]
+
+    def delete_orders(self, order_ids):
+        deleted = []
+        with self._transaction() as conn:
+            for chunk in _chunks([int(order_id) for order_id in order_ids], DELETE_CHUNK_SIZE):
+                placeholders = ', '.join('?' for _ in chunk)
+                deleted.extend(self._decode_order(row) for row in conn.execute(
+                    f'select * from "order-list" where order_id in ({placeholders})', chunk))
+                conn.execute(f'delete from "order-list" where order_id in ({placeholders})', chunk)
+        return deleted
+
+    def delete_orders_through(self, through, sale_id=None):
+        with self._transaction() as conn:
+            if sale_id is not None:
+                return conn.execute('delete from "order-list" where order_id <= ? and sale_id = ?',
+                                    (through, sale_id)).rowcount
+            return conn.execute('delete from "order-list" where order_id <= ?', (through,)).rowcount
+
+    def archive_orders(self, through, batch_size=500, sale_id=None):
+        columns = ', '.join(ORDER_COLUMNS)
+        # Without a sale, "? is null" is always true and keeps the parameters the same
+        scope = 'and sale_id = ?' if sale_id is not None else 'and ? is null'
+        archived = 0
+        after = -1
+        while True:
+            with self._transaction() as conn:
+                cursor = conn.execute(
+                    f'insert or replace into "order-archive" ({columns}) '
+                    f'select {columns} from "order-list" where order_id > ? and order_id <= ? {scope} '
+                    f'order by order_id limit ?',
+                    (after, through, sale_id, batch_size),
+                )
+                copied = cursor.rowcount
+                if copied:
+                    after = conn.execute(
+                        'select max(order_id) from (select order_id from "order-list" '
+                        f'where order_id > ? and order_id <= ? {scope} order by order_id limit ?)',
+                        (after, through, sale_id, batch_size),
+                    ).fetchone()[0]
+            archived += copied
+            if copied < batch_size:
+                return archived
+
+
+def create_repository(backend=None):
+    """Build the repository selected by ``backend`` or ``STORAGE_BACKEND``."""
+    backend = (backend or os.environ.get('STORAGE_BACKEND', 'supabase')).lower()
+
+    if backend == 'sqlite':
+        return SQLiteRepository(os.environ.get('SQLITE_PATH', ':memory:'))
+
+    if backend == 'supabase':
+        # Import here (in the gunicorn master when preloading) but connect
+        # lazily, so every worker gets its own client after the fork. That
+        # client keeps its connections to PostgREST alive and is shared by
+        # every thread of the worker, query pool included.
+        import httpx
+        from supabase import create_client
+        from supabase.lib.client_options import ClientOptions
+
+        # Fail fast when Supabase can't be reached rather than holding a
+        # request thread; reads and RPCs get longer to finish
+        timeout = httpx.Timeout(float(os.environ.get('SUPABASE_TIMEOUT', '10')),
+                                connect=float(os.environ.get('SUPABASE_CONNECT_TIMEOUT', '3')))
+        return SupabaseRepository(client_factory=lambda: create_client(
+            os.environ.get('SUPA_URL'), os.environ.get('SUPA_KEY'),
+            options=ClientOptions(postgrest_client_timeout=timeout)))
+
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")